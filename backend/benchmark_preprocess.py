@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Benchmark preprocessing hand-off between processes: in-process vs a process
+pool returning pickled PIL images vs PreprocessPool (shared memory).
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import pickle
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from services.image_processor import ImageProcessor
+from services.preprocess_pool import PreprocessPool
+
+_pickle_processor = None
+
+def _init_pickle_worker():
+    global _pickle_processor
+    _pickle_processor = ImageProcessor()
+
+def _pickle_worker(image_path):
+    start_time = time.perf_counter()
+    image = _pickle_processor.preprocess_image(image_path)
+    return image, (time.perf_counter() - start_time) * 1000
+
+def make_test_film(path: str, size: int):
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:size, 0:size]
+    film = 120 + 60 * np.sin(x / (size / 10)) * np.cos(y / (size / 12)) + rng.normal(0, 8, (size, size))
+    Image.fromarray(film.clip(0, 255).astype(np.uint8)).save(path)
+
+def bench_in_process(path: str, iterations: int):
+    processor = ImageProcessor()
+    start_time = time.perf_counter()
+    for _ in range(iterations):
+        processor.preprocess_image(path)
+    return (time.perf_counter() - start_time) * 1000 / iterations
+
+def bench_pickled_pool(path: str, iterations: int, workers: int):
+    executor = ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn"), initializer=_init_pickle_worker
+    )
+    list(executor.map(_pickle_worker, [path] * workers))  # warm up
+
+    roundtrip_ms = worker_ms = ipc_bytes = 0
+    for _ in range(iterations):
+        start_time = time.perf_counter()
+        image, elapsed = executor.submit(_pickle_worker, path).result()
+        roundtrip_ms += (time.perf_counter() - start_time) * 1000
+        worker_ms += elapsed
+        ipc_bytes += len(pickle.dumps((image, elapsed)))
+    executor.shutdown()
+    return roundtrip_ms / iterations, (roundtrip_ms - worker_ms) / iterations, ipc_bytes / iterations
+
+async def bench_shared_memory_pool(path: str, iterations: int, workers: int):
+    pool = PreprocessPool(workers)
+    await asyncio.gather(*(pool.preprocess(path) for _ in range(workers)))  # warm up
+    pool.stats = {'tasks': 0, 'worker_ms': 0.0, 'roundtrip_ms': 0.0, 'ipc_bytes': 0}
+
+    start_time = time.perf_counter()
+    for _ in range(iterations):
+        await pool.preprocess(path)
+    elapsed = (time.perf_counter() - start_time) * 1000 / iterations
+    stats = pool.get_stats()
+    pool.shutdown()
+    return elapsed, stats['mean_overhead_ms'], stats['mean_ipc_bytes']
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=3000, help="Synthetic film width/height in pixels")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+
+    # The synthetic film is smooth, so keep the quality gate from rejecting it
+    os.environ.setdefault("QUALITY_GATE_MODE", "flag")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "film.png")
+        make_test_film(path, args.size)
+
+        print(f"Film {args.size}x{args.size}, {args.iterations} iterations, {args.workers} workers")
+        print(f"{'mode':<22}{'per image ms':>14}{'IPC overhead ms':>18}{'IPC bytes':>12}")
+
+        print(f"{'in-process':<22}{bench_in_process(path, args.iterations):>14.1f}{'-':>18}{'-':>12}")
+
+        total, overhead, ipc_bytes = bench_pickled_pool(path, args.iterations, args.workers)
+        print(f"{'pool, pickled PIL':<22}{total:>14.1f}{overhead:>18.2f}{ipc_bytes:>12.0f}")
+
+        total, overhead, ipc_bytes = asyncio.run(bench_shared_memory_pool(path, args.iterations, args.workers))
+        print(f"{'pool, shared memory':<22}{total:>14.1f}{overhead:>18.2f}{ipc_bytes:>12.0f}")
+
+if __name__ == "__main__":
+    main()
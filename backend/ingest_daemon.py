@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Folder ingestion daemon: analyses chest X-rays dropped into a watch directory
+(e.g. PACS/modality exports) without going through the HTTP API.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import sys
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+from models.medgemma_model import MedGemmaModel
+from services.image_processor import ImageProcessor
+from services.tb_analyzer import TBAnalyzer
+from services.results_store import ResultsStore
+from services.duplicate_index import DuplicateIndex
+from services.triage_router import TriageRouter
+from services.analysis_pipeline import AnalysisPipeline
+from services.preprocess_pool import PreprocessPool
+from services.folder_ingestor import FolderIngestor
+
+logging.basicConfig(
+    level=getattr(logging, os.getenv("LOG_LEVEL", "INFO")),
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Watch a directory and analyse new chest X-rays")
+    parser.add_argument("--watch-dir", default=os.getenv("INGEST_WATCH_DIR", "ingest/incoming"))
+    parser.add_argument("--processed-dir", default=os.getenv("INGEST_PROCESSED_DIR", "ingest/processed"))
+    parser.add_argument("--failed-dir", default=os.getenv("INGEST_FAILED_DIR", "ingest/failed"))
+    parser.add_argument("--results-file", default=os.getenv("INGEST_RESULTS_FILE"),
+                        help="Optional JSONL file that every result is appended to")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("INGEST_CONCURRENCY", "2")))
+    parser.add_argument("--poll-interval", type=float, default=float(os.getenv("INGEST_POLL_INTERVAL_SECONDS", "5")))
+    parser.add_argument("--preprocess-workers", type=int, default=int(os.getenv("PREPROCESS_WORKERS", "0")),
+                        help="Preprocess in this many worker processes (0 = in-process)")
+    parser.add_argument("--settle-seconds", type=float, default=float(os.getenv("INGEST_SETTLE_SECONDS", "2")))
+    parser.add_argument("--max-attempts", type=int, default=int(os.getenv("INGEST_MAX_ATTEMPTS", "10")),
+                        help="Move a film to the failed directory after this many model/endpoint failures")
+    parser.add_argument("--retry-max-delay", type=float, default=float(os.getenv("INGEST_RETRY_MAX_DELAY_SECONDS", "600")),
+                        help="Cap on the exponential backoff between retries")
+    return parser.parse_args()
+
+async def main():
+    args = parse_args()
+
+    model = MedGemmaModel()
+    try:
+        await model.load_model()
+    except Exception as e:
+        print(f"❌ Failed to establish API connection: {e}")
+        print("💡 Make sure to set HUGGINGFACE_API_TOKEN environment variable")
+        sys.exit(1)
+
+    results_store = ResultsStore()
+    try:
+        results_store.start()
+    except Exception as e:
+        print(f"⚠️ Results store unavailable, results will not be persisted: {e}")
+
+    image_processor = ImageProcessor()
+    preprocess_pool = None
+    if args.preprocess_workers > 0:
+        preprocess_pool = PreprocessPool(args.preprocess_workers, image_processor.target_size)
+
+    pipeline = AnalysisPipeline(
+        image_processor, TBAnalyzer(), results_store, DuplicateIndex(), TriageRouter(), model, preprocess_pool
+    )
+    ingestor = FolderIngestor(
+        pipeline,
+        watch_dir=args.watch_dir,
+        processed_dir=args.processed_dir,
+        failed_dir=args.failed_dir,
+        concurrency=args.concurrency,
+        poll_interval=args.poll_interval,
+        settle_seconds=args.settle_seconds,
+        results_file=args.results_file,
+        max_attempts=args.max_attempts,
+        retry_max_delay=args.retry_max_delay
+    )
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, ingestor.stop)
+
+    print(f"👀 Watching {args.watch_dir} for new X-rays")
+    try:
+        await ingestor.run()
+    finally:
+        results_store.stop()
+        if preprocess_pool:
+            preprocess_pool.shutdown()
+        print(f"✅ Ingestion stopped: {ingestor.stats}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
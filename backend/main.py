@@ -1,12 +1,16 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 import uvicorn
 import asyncio
 from pathlib import Path
-import tempfile
+from dataclasses import asdict
+from datetime import datetime
+from typing import Optional, Dict, Any, List, AsyncIterator
 import os
+import json
+import time
 from dotenv import load_dotenv
 import logging
 
@@ -14,14 +18,23 @@ import logging
 load_dotenv()
 
 from models.medgemma_model import MedGemmaModel
-from services.image_processor import ImageProcessor
+from services.image_processor import ImageProcessor, ImageTooLargeError, ImageQualityError, ImageDecodeError, ENHANCEMENT_PRESETS
 from services.tb_analyzer import TBAnalyzer
+from services.upload_handler import (
+    UploadHandler, UploadRejectedError, UploadSizeLimitMiddleware, ReceivedUpload, multipart_upload_openapi
+)
+from services.results_store import ResultsStore
+from services.duplicate_index import DuplicateIndex
+from services.triage_router import TriageRouter
+from services.analysis_pipeline import AnalysisPipeline
+from services.preprocess_pool import PreprocessPool
 
 # Configure logging
 logging.basicConfig(
     level=getattr(logging, os.getenv("LOG_LEVEL", "INFO")),
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 )
+logger = logging.getLogger(__name__)
 
 app = FastAPI(
     title="TB Detector API",
@@ -29,7 +42,27 @@ app = FastAPI(
     version="1.0.0"
 )
 
-# CORS configuration
+model = None
+image_processor = ImageProcessor()
+tb_analyzer = TBAnalyzer()
+upload_handler = UploadHandler()
+results_store = ResultsStore()
+duplicate_index = DuplicateIndex()
+triage_router = TriageRouter()
+pipeline = AnalysisPipeline(image_processor, tb_analyzer, results_store, duplicate_index, triage_router)
+
+PREPROCESS_WORKERS = int(os.getenv("PREPROCESS_WORKERS", "0"))
+
+MAX_BATCH_FILES = 10
+
+# Counts body bytes as they arrive, so oversize uploads are cut off before they are written to disk
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    upload_handler=upload_handler,
+    max_files_by_path={"/analyze": 1, "/analyze/stream": 1, "/batch-analyze": MAX_BATCH_FILES}
+)
+
+# CORS configuration (added last so it wraps the upload limit and 413s carry CORS headers)
 cors_origins = os.getenv("CORS_ORIGINS", "http://localhost:3000").split(",")
 
 app.add_middleware(
@@ -40,9 +73,42 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-model = None
-image_processor = ImageProcessor()
-tb_analyzer = TBAnalyzer()
+PRESET_QUERY = Query(None, description=f"Preprocessing preset: {', '.join(ENHANCEMENT_PRESETS)}")
+
+def resolve_preset(preset: Optional[str]) -> str:
+    try:
+        return image_processor.resolve_preset(preset)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _discard_uploads(received: List[ReceivedUpload]):
+    # Temp files the endpoint didn't get to, e.g. after an early 4xx/503
+    for item in received:
+        if item.upload is not None and os.path.exists(item.upload.path):
+            os.unlink(item.upload.path)
+
+async def receive_single_upload(request: Request) -> AsyncIterator[ReceivedUpload]:
+    try:
+        received = await upload_handler.receive_uploads(request, "file", stop_on_rejection=True)
+    except UploadRejectedError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    try:
+        file = received[0]
+        if file.error is not None:
+            raise HTTPException(status_code=file.error.status_code, detail=file.error.detail)
+        yield file
+    finally:
+        _discard_uploads(received)
+
+async def receive_batch_uploads(request: Request) -> AsyncIterator[List[ReceivedUpload]]:
+    try:
+        received = await upload_handler.receive_uploads(request, "files")
+    except UploadRejectedError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    try:
+        yield received
+    finally:
+        _discard_uploads(received)
 
 # Mount static files for frontend (will be available after build)
 frontend_build_path = Path(__file__).parent.parent / "frontend" / "build"
@@ -52,6 +118,7 @@ async def startup_event():
     global model
     try:
         model = MedGemmaModel()
+        pipeline.model = model
         await model.load_model()
         print("✅ MedGemma-4B API connection established successfully")
     except Exception as e:
@@ -60,6 +127,29 @@ async def startup_event():
         # Don't raise the exception to allow the server to start
         # The health endpoint will indicate the model status
 
+@app.on_event("startup")
+async def start_results_store():
+    try:
+        results_store.start()
+    except Exception as e:
+        print(f"⚠️ Results store unavailable, results will not be persisted: {e}")
+
+@app.on_event("shutdown")
+async def stop_results_store():
+    # Flushes any queued writes before exit
+    results_store.stop()
+
+@app.on_event("startup")
+async def start_preprocess_pool():
+    if PREPROCESS_WORKERS > 0:
+        pipeline.preprocess_pool = PreprocessPool(PREPROCESS_WORKERS, image_processor.target_size)
+        print(f"✅ Preprocessing in {PREPROCESS_WORKERS} worker processes")
+
+@app.on_event("shutdown")
+async def stop_preprocess_pool():
+    if pipeline.preprocess_pool:
+        pipeline.preprocess_pool.shutdown()
+
 @app.get("/")
 async def root():
     return {"message": "TB Detector API", "status": "running"}
@@ -75,38 +165,47 @@ async def health_check():
         "api_version": "1.0.0",
         "deployment": "huggingface_api",
         "has_api_token": has_api_token,
+        "duplicate_index": duplicate_index.get_stats(),
+        "quality_gate": image_processor.get_quality_stats(),
+        "triage": triage_router.get_stats(),
+        "preprocess_pool": pipeline.preprocess_pool.get_stats() if pipeline.preprocess_pool else None,
+        "preprocessing": {
+            "default_preset": image_processor.default_preset,
+            "presets": list(ENHANCEMENT_PRESETS),
+            "cache": pipeline.get_cache_stats()
+        },
         "model_info": model.get_model_info() if model else None
     }
 
-@app.post("/analyze")
-async def analyze_xray(file: UploadFile = File(...)):
+@app.post("/analyze", openapi_extra=multipart_upload_openapi("file"))
+async def analyze_xray(file: ReceivedUpload = Depends(receive_single_upload), preset: Optional[str] = PRESET_QUERY):
     if not model or not model.is_loaded:
         raise HTTPException(
             status_code=503, 
             detail="API connection not established. Please check HUGGINGFACE_API_TOKEN environment variable."
         )
     
-    if not file.content_type.startswith("image/"):
-        raise HTTPException(status_code=400, detail="File must be an image")
+    preset = resolve_preset(preset)
+    upload = file.upload
     
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp_file:
-            content = await file.read()
-            tmp_file.write(content)
-            tmp_file_path = tmp_file.name
-        
         try:
-            processed_image = image_processor.preprocess_image(tmp_file_path)
-            
-            result = await model.analyze_image(processed_image)
-            
-            tb_analysis = tb_analyzer.analyze_for_tb(result)
+            analysis = await pipeline.run(upload, file.filename, preset)
+            tb_analysis = analysis["tb_analysis"]
             
             return JSONResponse({
                 "success": True,
+                "result_id": analysis["result_id"],
+                "image_hash": analysis["image_hash"],
+                "perceptual_hash": analysis["perceptual_hash"],
+                "preset": analysis["preset"],
+                "reused_result": analysis["reused_result"],
+                "duplicate_of": analysis["duplicate_of"],
+                "quality": analysis["quality"],
+                "triage": analysis["triage"],
                 "filename": file.filename,
                 "analysis": {
-                    "raw_report": result,
+                    "raw_report": analysis["raw_report"],
                     "tb_analysis": tb_analysis,
                     "confidence": tb_analysis.get("confidence", 0.0),
                     "findings": tb_analysis.get("findings", []),
@@ -116,57 +215,182 @@ async def analyze_xray(file: UploadFile = File(...)):
             })
             
         finally:
-            os.unlink(tmp_file_path)
+            os.unlink(upload.path)
             
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ImageDecodeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ImageQualityError as e:
+        raise HTTPException(status_code=422, detail={
+            "message": str(e),
+            "quality": asdict(e.report)
+        })
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
-@app.post("/batch-analyze")
-async def batch_analyze(files: list[UploadFile] = File(...)):
+@app.post("/analyze/stream", openapi_extra=multipart_upload_openapi("file"))
+async def analyze_xray_stream(file: ReceivedUpload = Depends(receive_single_upload), preset: Optional[str] = PRESET_QUERY):
+    """Stream the report as newline-delimited JSON events while it is generated.
+    
+    Events: "token" (generated text), "findings" (provisional findings from
+    completed sentences plus a running risk estimate), "result" (the final
+    analysis, same shape as /analyze) and "error".
+    """
     if not model or not model.is_loaded:
         raise HTTPException(
             status_code=503, 
             detail="API connection not established. Please check HUGGINGFACE_API_TOKEN environment variable."
         )
     
-    if len(files) > 10:
-        raise HTTPException(status_code=400, detail="Maximum 10 files allowed")
+    preset = resolve_preset(preset)
+    upload = file.upload
+    
+    # Validation errors are reported as HTTP errors before the stream starts
+    start_time = time.perf_counter()
+    try:
+        prepared = await pipeline.prepare(upload, preset)
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ImageDecodeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ImageQualityError as e:
+        raise HTTPException(status_code=422, detail={
+            "message": str(e),
+            "quality": asdict(e.report)
+        })
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
+    finally:
+        os.unlink(upload.path)
+    
+    def event(event_type: str, **data) -> str:
+        return json.dumps({"type": event_type, **data}) + "\n"
+    
+    def final_event(analysis: Dict[str, Any]) -> str:
+        tb_analysis = analysis["tb_analysis"]
+        return event(
+            "result",
+            success=True,
+            filename=file.filename,
+            result_id=analysis["result_id"],
+            image_hash=analysis["image_hash"],
+            perceptual_hash=analysis["perceptual_hash"],
+            preset=analysis["preset"],
+            reused_result=analysis["reused_result"],
+            duplicate_of=analysis["duplicate_of"],
+            quality=analysis["quality"],
+            triage=analysis["triage"],
+            analysis={
+                "raw_report": analysis["raw_report"],
+                "tb_analysis": tb_analysis,
+                "confidence": tb_analysis.get("confidence", 0.0),
+                "findings": tb_analysis.get("findings", []),
+                "recommendation": tb_analysis.get("recommendation", "")
+            },
+            disclaimer="This analysis is for research purposes only and should not be used for medical diagnosis."
+        )
+    
+    async def generate():
+        try:
+            match = prepared["match"]
+            if match:
+                prior = match["payload"]
+                yield final_event(pipeline.complete(
+                    upload, file.filename, prepared, prior["raw_report"], prior["tb_analysis"], 0.0, start_time
+                ))
+                return
+            
+            inference_start = time.perf_counter()
+            triage = await pipeline.screen(prepared)
+            if not triage["escalate"]:
+                yield final_event(pipeline.complete_screening(
+                    upload, file.filename, prepared, triage, inference_start, start_time
+                ))
+                return
+            
+            session = tb_analyzer.start_incremental()
+            report_start = time.perf_counter()
+            async for text in model.stream_analysis(prepared["processed_image"]):
+                yield event("token", text=text)
+                findings = session.feed(text)
+                if findings:
+                    yield event("findings", findings=findings, provisional=session.provisional())
+            triage_router.record_full_report((time.perf_counter() - report_start) * 1000)
+            inference_ms = (time.perf_counter() - inference_start) * 1000
+            
+            yield final_event(pipeline.complete(
+                upload, file.filename, prepared, session.report, session.finish(), inference_ms, start_time, triage
+            ))
+        except Exception as e:
+            logger.error(f"Streaming analysis failed: {e}")
+            yield event("error", detail=f"Analysis failed: {str(e)}")
+    
+    return StreamingResponse(
+        generate(),
+        media_type="application/x-ndjson",
+        # Stop nginx from buffering the stream
+        headers={"X-Accel-Buffering": "no", "Cache-Control": "no-cache"}
+    )
+
+@app.post("/batch-analyze", openapi_extra=multipart_upload_openapi("files", multiple=True))
+async def batch_analyze(files: List[ReceivedUpload] = Depends(receive_batch_uploads), preset: Optional[str] = PRESET_QUERY):
+    if not model or not model.is_loaded:
+        raise HTTPException(
+            status_code=503, 
+            detail="API connection not established. Please check HUGGINGFACE_API_TOKEN environment variable."
+        )
+    
+    if len(files) > MAX_BATCH_FILES:
+        raise HTTPException(status_code=400, detail=f"Maximum {MAX_BATCH_FILES} files allowed")
+    
+    preset = resolve_preset(preset)
     
     results = []
     
     for file in files:
-        if not file.content_type.startswith("image/"):
+        if file.error is not None:
             results.append({
                 "filename": file.filename,
                 "success": False,
-                "error": "File must be an image"
+                "error": file.error.detail
             })
             continue
         
         try:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp_file:
-                content = await file.read()
-                tmp_file.write(content)
-                tmp_file_path = tmp_file.name
+            upload = file.upload
             
             try:
-                processed_image = image_processor.preprocess_image(tmp_file_path)
-                result = await model.analyze_image(processed_image)
-                tb_analysis = tb_analyzer.analyze_for_tb(result)
+                analysis = await pipeline.run(upload, file.filename, preset)
+                tb_analysis = analysis["tb_analysis"]
                 
                 results.append({
                     "filename": file.filename,
                     "success": True,
+                    "result_id": analysis["result_id"],
+                    "image_hash": analysis["image_hash"],
+                    "preset": analysis["preset"],
+                    "reused_result": analysis["reused_result"],
+                    "duplicate_of": analysis["duplicate_of"],
+                    "quality": analysis["quality"],
+                    "triage": analysis["triage"],
                     "analysis": {
-                        "raw_report": result,
+                        "raw_report": analysis["raw_report"],
                         "tb_analysis": tb_analysis,
                         "confidence": tb_analysis.get("confidence", 0.0)
                     }
                 })
                 
             finally:
-                os.unlink(tmp_file_path)
+                os.unlink(upload.path)
                 
+        except ImageQualityError as e:
+            results.append({
+                "filename": file.filename,
+                "success": False,
+                "error": str(e),
+                "quality": asdict(e.report)
+            })
         except Exception as e:
             results.append({
                 "filename": file.filename,
@@ -181,6 +405,35 @@ async def batch_analyze(files: list[UploadFile] = File(...)):
         "disclaimer": "These analyses are for research purposes only and should not be used for medical diagnosis."
     })
 
+@app.get("/results")
+async def list_results(
+    risk_level: Optional[str] = Query(None, description="Filter by TB risk level (high, medium, low, minimal)"),
+    since: Optional[datetime] = Query(None, description="Only results created at or after this time"),
+    until: Optional[datetime] = Query(None, description="Only results created before this time"),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0)
+):
+    return await asyncio.to_thread(
+        results_store.list_results,
+        risk_level=risk_level, since=since, until=until, limit=limit, offset=offset
+    )
+
+@app.get("/results/by-hash/{image_hash}")
+async def get_results_by_hash(
+    image_hash: str,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0)
+):
+    results = await asyncio.to_thread(results_store.get_results_by_hash, image_hash.lower(), limit, offset)
+    return {"results": results, "limit": limit, "offset": offset}
+
+@app.get("/results/{result_id}")
+async def get_result(result_id: str):
+    result = await asyncio.to_thread(results_store.get_result, result_id)
+    if not result:
+        raise HTTPException(status_code=404, detail="Result not found")
+    return result
+
 # Mount frontend static files (after API routes)
 @app.on_event("startup")
 async def mount_frontend():
@@ -0,0 +1,211 @@
+import asyncio
+import logging
+import time
+from collections import deque, defaultdict
+from dataclasses import dataclass, field
+from typing import Optional, List, Dict, Any, Tuple, Awaitable, Callable, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class Endpoint:
+    url: str
+    outstanding: int = 0
+    total_requests: int = 0
+    total_failures: int = 0
+    consecutive_failures: int = 0
+    unhealthy_until: float = 0.0
+    # Successful request latencies per request class (e.g. "screening", "report")
+    latencies: Dict[str, deque] = field(default_factory=lambda: defaultdict(lambda: deque(maxlen=200)))
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.unhealthy_until
+
+class EndpointPool:
+    """Inference endpoints with least-outstanding-requests routing and hedging.
+
+    An endpoint that fails `failure_threshold` times in a row is taken out of
+    rotation for `cooldown_seconds`. Requests still running after the pool's
+    recent p95 latency for their request class get a duplicate sent to
+    another endpoint; whichever finishes first wins and the other is
+    cancelled. Classes keep separate latency windows, so short screening
+    calls don't set the hedge delay for full reports.
+    """
+
+    def __init__(
+        self,
+        urls: List[str],
+        hedging_enabled: bool = True,
+        hedge_percentile: float = 95.0,
+        min_hedge_delay: float = 2.0,
+        default_hedge_delay: float = 30.0,
+        failure_threshold: int = 3,
+        cooldown_seconds: float = 30.0
+    ):
+        if not urls:
+            raise ValueError("At least one inference endpoint is required")
+        self.endpoints = [Endpoint(url=url) for url in urls]
+        self.hedging_enabled = hedging_enabled
+        self.hedge_percentile = hedge_percentile
+        self.min_hedge_delay = min_hedge_delay
+        self.default_hedge_delay = default_hedge_delay
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.stats = {'hedged': 0, 'hedge_wins': 0}
+
+    def acquire(self, exclude: Sequence[Endpoint] = (), request_class: str = "default") -> Optional[Endpoint]:
+        """Pick the endpoint with the fewest requests in flight, preferring healthy ones"""
+        candidates = [e for e in self.endpoints if e not in exclude]
+        if not candidates:
+            return None
+        healthy = [e for e in candidates if e.healthy]
+        if healthy:
+            candidates = healthy
+        elif exclude:
+            # Never hedge or fail over onto an endpoint we already know is down
+            return None
+
+        endpoint = min(
+            candidates,
+            key=lambda e: (
+                e.outstanding,
+                float(np.mean(e.latencies[request_class])) if e.latencies.get(request_class) else 0.0
+            )
+        )
+        endpoint.outstanding += 1
+        endpoint.total_requests += 1
+        return endpoint
+
+    def release(self, endpoint: Endpoint, elapsed: Optional[float], success: bool, request_class: str = "default"):
+        """Record the outcome of a request; pass elapsed=None to keep it out of the latency window"""
+        endpoint.outstanding -= 1
+        if success:
+            endpoint.consecutive_failures = 0
+            if elapsed is not None:
+                endpoint.latencies[request_class].append(elapsed)
+            return
+
+        endpoint.total_failures += 1
+        endpoint.consecutive_failures += 1
+        if endpoint.consecutive_failures >= self.failure_threshold:
+            endpoint.unhealthy_until = time.monotonic() + self.cooldown_seconds
+            logger.warning(f"Endpoint {endpoint.url} marked unhealthy for {self.cooldown_seconds:.0f}s")
+
+    def abandon(self, endpoint: Endpoint):
+        """Release a request that was cancelled by us; the endpoint's health is untouched"""
+        endpoint.outstanding -= 1
+
+    def mark_unhealthy(self, endpoint: Endpoint):
+        endpoint.unhealthy_until = time.monotonic() + self.cooldown_seconds
+
+    def hedge_delay(self, request_class: str = "default") -> float:
+        samples = [latency for e in self.endpoints for latency in e.latencies.get(request_class, ())]
+        if len(samples) < 20:
+            return self.default_hedge_delay
+        return max(self.min_hedge_delay, float(np.percentile(samples, self.hedge_percentile)))
+
+    async def request(
+        self,
+        send: Callable[[str], Awaitable[Tuple[int, str]]],
+        request_class: str = "default"
+    ) -> Tuple[int, str]:
+        """Run send(url) against the pool, hedging slow requests onto a second endpoint.
+
+        send returns (status, body). Responses with status >= 500 and
+        exceptions count as endpoint failures: the other in-flight attempt is
+        awaited instead, or the request fails over once to an untried endpoint.
+        """
+        primary = self.acquire(request_class=request_class)
+        attempts = {asyncio.ensure_future(self._attempt(primary, send, request_class)): primary}
+        hedged = False
+        failed_over = False
+
+        try:
+            done, _ = await asyncio.wait(
+                attempts, timeout=self.hedge_delay(request_class) if self.hedging_enabled else None
+            )
+            if not done:
+                secondary = self.acquire(exclude=[primary], request_class=request_class)
+                if secondary is not None:
+                    hedged = True
+                    self.stats['hedged'] += 1
+                    logger.info(f"Hedging slow request from {primary.url} to {secondary.url}")
+                    attempts[asyncio.ensure_future(self._attempt(secondary, send, request_class))] = secondary
+
+            pending = set(attempts)
+            last_error: Optional[BaseException] = None
+            last_result: Optional[Tuple[int, str]] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        last_error = task.exception()
+                        last_result = None
+                    else:
+                        status, body = task.result()
+                        if status < 500:
+                            if hedged and attempts[task] is not primary:
+                                self.stats['hedge_wins'] += 1
+                            return status, body
+                        last_result = (status, body)
+
+                if not pending and not failed_over:
+                    fallback = self.acquire(exclude=list(attempts.values()), request_class=request_class)
+                    if fallback is not None:
+                        failed_over = True
+                        logger.info(f"Failing over to {fallback.url}")
+                        task = asyncio.ensure_future(self._attempt(fallback, send, request_class))
+                        attempts[task] = fallback
+                        pending = {task}
+
+            if last_result is not None:
+                return last_result
+            raise last_error
+        finally:
+            for task in attempts:
+                if not task.done():
+                    task.cancel()
+
+    async def _attempt(self, endpoint: Endpoint, send, request_class: str) -> Tuple[int, str]:
+        start_time = time.perf_counter()
+        try:
+            status, body = await send(endpoint.url)
+        except asyncio.CancelledError:
+            # Lost a hedge race
+            self.abandon(endpoint)
+            raise
+        except Exception:
+            self.release(endpoint, None, False)
+            raise
+
+        self.release(
+            endpoint, time.perf_counter() - start_time if status == 200 else None, status < 500, request_class
+        )
+        return status, body
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'hedging_enabled': self.hedging_enabled,
+            'hedge_delay_seconds': {
+                request_class: round(self.hedge_delay(request_class), 3)
+                for request_class in sorted({c for e in self.endpoints for c in e.latencies})
+            },
+            **self.stats,
+            'endpoints': [
+                {
+                    'url': e.url,
+                    'healthy': e.healthy,
+                    'outstanding': e.outstanding,
+                    'requests': e.total_requests,
+                    'failures': e.total_failures,
+                    'p95_seconds': {
+                        request_class: round(float(np.percentile(samples, 95)), 3)
+                        for request_class, samples in e.latencies.items() if samples
+                    }
+                }
+                for e in self.endpoints
+            ]
+        }
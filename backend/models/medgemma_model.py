@@ -5,16 +5,36 @@ from PIL import Image
 import logging
 import asyncio
 import os
-from typing import Optional, Dict, Any
+import time
+from typing import Optional, Dict, Any, AsyncIterator
 import aiohttp
 import json
+import re
+
+from models.endpoint_pool import EndpointPool
 
 logger = logging.getLogger(__name__)
 
+class _StreamFallback(Exception):
+    """Raised before the first token when streaming should give way to analyze_image"""
+    pass
+
 class MedGemmaModel:
     def __init__(self):
         self.model_name = "google/medgemma-4b-it"
+        self.model_revision = os.getenv("MEDGEMMA_MODEL_REVISION", "main")
         self.hf_api_url = f"https://api-inference.huggingface.co/models/{self.model_name}"
+        
+        # Comma-separated replicas (HF dedicated endpoints, TGI, local stand-ins); defaults to the HF API
+        endpoints = [url.strip() for url in os.getenv("MEDGEMMA_ENDPOINTS", "").split(",") if url.strip()]
+        if endpoints:
+            self.hf_api_url = endpoints[0]
+        self.endpoint_pool = EndpointPool(
+            endpoints or [self.hf_api_url],
+            hedging_enabled=os.getenv("MEDGEMMA_HEDGING_ENABLED", "true").lower() == "true",
+            hedge_percentile=float(os.getenv("MEDGEMMA_HEDGE_PERCENTILE", "95")),
+            min_hedge_delay=float(os.getenv("MEDGEMMA_MIN_HEDGE_DELAY_SECONDS", "2"))
+        )
         self.is_loaded = False
         self.api_token = os.getenv("HUGGINGFACE_API_TOKEN")
         
@@ -38,6 +58,17 @@ class MedGemmaModel:
             raise e
     
     async def _test_api_connection(self) -> bool:
+        """Test every configured endpoint; succeeds if at least one is usable"""
+        results = await asyncio.gather(*(
+            self._test_endpoint(endpoint.url) for endpoint in self.endpoint_pool.endpoints
+        ))
+        for endpoint, available in zip(self.endpoint_pool.endpoints, results):
+            if not available:
+                logger.warning(f"Endpoint {endpoint.url} failed the connection test")
+                self.endpoint_pool.mark_unhealthy(endpoint)
+        return any(results)
+    
+    async def _test_endpoint(self, url: str) -> bool:
         """Test if the API is accessible and the model is available"""
         try:
             headers = {"Authorization": f"Bearer {self.api_token}"} if self.api_token else {}
@@ -63,7 +94,7 @@ class MedGemmaModel:
                 }
                 
                 async with session.post(
-                    self.hf_api_url,
+                    url,
                     headers=headers,
                     json=payload,
                     timeout=aiohttp.ClientTimeout(total=30)
@@ -104,25 +135,75 @@ Pay special attention to any findings that could suggest active or inactive tube
 
 Provide your assessment with confidence levels for any TB-related findings."""
 
+    def _create_screening_prompt(self) -> str:
+        # No digits in the prompt, so an echoed prompt can't be mistaken for the score
+        return (
+            "You are screening chest X-rays for tuberculosis. Reply with a single integer "
+            "between zero and one hundred giving the likelihood that this chest X-ray shows "
+            "any abnormality suggestive of tuberculosis. Reply with the number only."
+        )
+
     async def analyze_image(self, image: Image.Image) -> str:
+        # Create the prompt
+        prompt = self._create_tb_focused_prompt()
+        user_prompt = "Please analyze this chest X-ray for tuberculosis and other findings:"
+        
+        return await self._generate(image, f"{prompt}\n\n{user_prompt}", max_new_tokens=500, temperature=0.3, request_class="report")
+    
+    async def screen_image(self, image: Image.Image, max_new_tokens: int = 8) -> Optional[float]:
+        """Fast triage pass: returns a TB suspicion score in [0, 1], or None if the answer is unparseable"""
+        prompt = self._create_screening_prompt()
+        text = await self._generate(image, prompt, max_new_tokens=max_new_tokens, request_class="screening")
+        
+        # Some endpoints echo the prompt before the completion
+        if text.startswith(prompt):
+            text = text[len(prompt):]
+        
+        # Only a bare 0-100 integer is trusted; decimals, fractions, ranges and
+        # prose could be on another scale, so they return None and escalate
+        match = re.fullmatch(r'\s*(\d{1,3})\s*%?\s*\.?\s*', text)
+        if not match or int(match.group(1)) > 100:
+            logger.warning(f"Could not parse screening answer: {text!r}")
+            return None
+        
+        return int(match.group(1)) / 100.0
+    
+    async def _generate(
+        self,
+        image: Image.Image,
+        text: str,
+        max_new_tokens: int,
+        temperature: Optional[float] = None,
+        request_class: str = "default"
+    ) -> str:
+        """Run one generation, trying each known payload format; greedy decoding when temperature is None.
+
+        request_class keys the endpoint pool's latency window, so hedging
+        compares the request against others of the same length.
+        """
         if not self.is_loaded:
             raise Exception("API connection not established")
         
         try:
-            # Convert image to base64
-            buffered = io.BytesIO()
-            image.save(buffered, format="PNG")
-            img_base64 = base64.b64encode(buffered.getvalue()).decode()
+            img_base64 = self._encode_image(image)
             
-            # Create the prompt
-            prompt = self._create_tb_focused_prompt()
-            user_prompt = "Please analyze this chest X-ray for tuberculosis and other findings:"
+            if temperature is not None:
+                parameters = {
+                    "max_new_tokens": max_new_tokens,
+                    "temperature": temperature,
+                    "top_p": 0.9,
+                    "do_sample": True
+                }
+                alternative_parameters = {
+                    "max_new_tokens": max_new_tokens,
+                    "temperature": temperature
+                }
+            else:
+                parameters = {"max_new_tokens": max_new_tokens, "do_sample": False}
+                alternative_parameters = parameters
             
             # Prepare the API request
-            headers = {
-                "Authorization": f"Bearer {self.api_token}",
-                "Content-Type": "application/json"
-            } if self.api_token else {"Content-Type": "application/json"}
+            headers = self._build_headers()
             
             # Try multiple API formats as HF API can vary
             payloads_to_try = [
@@ -130,28 +211,20 @@ Provide your assessment with confidence levels for any TB-related findings."""
                 {
                     "inputs": {
                         "image": img_base64,
-                        "text": f"{prompt}\n\n{user_prompt}"
+                        "text": text
                     },
-                    "parameters": {
-                        "max_new_tokens": 500,
-                        "temperature": 0.3,
-                        "top_p": 0.9,
-                        "do_sample": True
-                    }
+                    "parameters": parameters
                 },
                 # Format 2: Alternative format
                 {
-                    "inputs": f"{prompt}\n\n{user_prompt}",
+                    "inputs": text,
                     "image": img_base64,
-                    "parameters": {
-                        "max_new_tokens": 500,
-                        "temperature": 0.3
-                    }
+                    "parameters": alternative_parameters
                 },
                 # Format 3: Simple format
                 {
                     "inputs": {
-                        "question": f"{prompt}\n\n{user_prompt}",
+                        "question": text,
                         "image": img_base64
                     }
                 }
@@ -162,36 +235,38 @@ Provide your assessment with confidence levels for any TB-related findings."""
                     try:
                         logger.info(f"Trying API format {i+1}/3...")
                         
-                        async with session.post(
-                            self.hf_api_url,
-                            headers=headers,
-                            json=payload,
-                            timeout=aiohttp.ClientTimeout(total=120)  # 2 minutes timeout
-                        ) as response:
-                            
-                            if response.status == 200:
-                                result = await response.json()
-                                return self._parse_api_response(result)
-                            
-                            elif response.status == 503:
-                                error_text = await response.text()
-                                if "loading" in error_text.lower():
-                                    # Model is still loading, wait and retry
-                                    logger.info("Model is loading, retrying in 30 seconds...")
-                                    await asyncio.sleep(30)
-                                    continue
-                                else:
-                                    raise Exception(f"Service unavailable: {error_text}")
-                            
-                            elif response.status == 422:
-                                error_text = await response.text()
-                                logger.warning(f"Format {i+1} failed with validation error: {error_text}")
-                                continue  # Try next format
-                            
+                        async def send(url: str, payload=payload):
+                            async with session.post(
+                                url,
+                                headers=headers,
+                                json=payload,
+                                timeout=aiohttp.ClientTimeout(total=120)  # 2 minutes timeout
+                            ) as response:
+                                return response.status, await response.text()
+                        
+                        # Routed to the least-loaded replica, hedged onto another if it runs slow
+                        status, error_text = await self.endpoint_pool.request(send, request_class)
+                        
+                        if status == 200:
+                            result = json.loads(error_text)
+                            return self._parse_api_response(result)
+                        
+                        elif status == 503:
+                            if "loading" in error_text.lower():
+                                # Model is still loading, wait and retry
+                                logger.info("Model is loading, retrying in 30 seconds...")
+                                await asyncio.sleep(30)
+                                continue
                             else:
-                                error_text = await response.text()
-                                raise Exception(f"API request failed with status {response.status}: {error_text}")
-                                
+                                raise Exception(f"Service unavailable: {error_text}")
+                        
+                        elif status == 422:
+                            logger.warning(f"Format {i+1} failed with validation error: {error_text}")
+                            continue  # Try next format
+                        
+                        else:
+                            raise Exception(f"API request failed with status {status}: {error_text}")
+                            
                     except asyncio.TimeoutError:
                         logger.warning(f"Format {i+1} timed out, trying next format...")
                         continue
@@ -207,6 +282,112 @@ Provide your assessment with confidence levels for any TB-related findings."""
             logger.error(f"Error during image analysis: {e}")
             raise e
     
+    async def stream_analysis(self, image: Image.Image) -> AsyncIterator[str]:
+        """Yield generated text chunks as they arrive from the inference endpoint.
+        
+        Uses the standard multimodal payload with streaming enabled. Endpoints
+        that ignore the stream flag and answer with plain JSON yield the whole
+        report as a single chunk. Endpoints that reject the payload (422) or
+        are still loading (503) fall back to analyze_image, with its format
+        fallbacks and loading retries, and likewise yield a single chunk.
+        """
+        try:
+            async for text in self._stream_generation(image):
+                yield text
+        except _StreamFallback as e:
+            logger.warning(f"{e}; falling back to analyze_image")
+            yield await self.analyze_image(image)
+    
+    async def _stream_generation(self, image: Image.Image) -> AsyncIterator[str]:
+        if not self.is_loaded:
+            raise Exception("API connection not established")
+        
+        prompt = self._create_tb_focused_prompt()
+        user_prompt = "Please analyze this chest X-ray for tuberculosis and other findings:"
+        payload = {
+            "inputs": {
+                "image": self._encode_image(image),
+                "text": f"{prompt}\n\n{user_prompt}"
+            },
+            "parameters": {
+                "max_new_tokens": 500,
+                "temperature": 0.3,
+                "top_p": 0.9,
+                "do_sample": True
+            },
+            "stream": True
+        }
+        
+        # Streams are routed to the least-loaded replica but not hedged
+        endpoint = self.endpoint_pool.acquire(request_class="report")
+        success = False
+        abandoned = False
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.post(
+                    endpoint.url,
+                    headers=self._build_headers(),
+                    json=payload,
+                    timeout=aiohttp.ClientTimeout(total=300, sock_read=120)
+                ) as response:
+                    if response.status != 200:
+                        error_text = await response.text()
+                        if response.status == 422 or (response.status == 503 and "loading" in error_text.lower()):
+                            # Nothing has been streamed yet, so the non-streaming path can take over
+                            success = True
+                            raise _StreamFallback(f"Streaming request got {response.status}: {error_text}")
+                        success = response.status < 500
+                        raise Exception(f"API request failed with status {response.status}: {error_text}")
+                    
+                    if "text/event-stream" not in response.headers.get("Content-Type", ""):
+                        yield self._parse_api_response(await response.json(content_type=None))
+                        success = True
+                        return
+                    
+                    async for raw_line in response.content:
+                        line = raw_line.decode("utf-8").strip()
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[len("data:"):].strip()
+                        if not data or data == "[DONE]":
+                            continue
+                        
+                        event = json.loads(data)
+                        if "error" in event:
+                            raise Exception(f"Streaming generation failed: {event['error']}")
+                        
+                        token = event.get("token") or {}
+                        if token.get("special"):
+                            continue
+                        text = token.get("text")
+                        if text:
+                            yield text
+                    success = True
+        except (GeneratorExit, asyncio.CancelledError):
+            # Client went away mid-stream
+            abandoned = True
+            raise
+        finally:
+            if abandoned:
+                self.endpoint_pool.abandon(endpoint)
+            else:
+                # A stream's duration includes however long the client took to read it,
+                # so it stays out of the latency window that sets the hedge delay
+                self.endpoint_pool.release(endpoint, None, success, "report")
+    
+    def _encode_image(self, image: Image.Image) -> str:
+        buffered = io.BytesIO()
+        image.save(buffered, format="PNG")
+        return base64.b64encode(buffered.getvalue()).decode()
+    
+    def _build_headers(self) -> Dict[str, str]:
+        if self.api_token:
+            return {
+                "Authorization": f"Bearer {self.api_token}",
+                "Content-Type": "application/json"
+            }
+        return {"Content-Type": "application/json"}
+    
     def _parse_api_response(self, response) -> str:
         """Parse the API response and extract the generated text"""
         try:
@@ -249,9 +430,12 @@ Provide your assessment with confidence levels for any TB-related findings."""
     def get_model_info(self) -> Dict[str, Any]:
         return {
             "model_name": self.model_name,
+            "model_revision": self.model_revision,
             "api_url": self.hf_api_url,
+            "endpoints": self.endpoint_pool.get_stats(),
             "is_loaded": self.is_loaded,
             "supports_multimodal": True,
+            "supports_streaming": True,
             "max_tokens": 500,
             "deployment": "huggingface_api"
         }
\ No newline at end of file
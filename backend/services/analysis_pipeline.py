@@ -0,0 +1,191 @@
+import logging
+import os
+import time
+from dataclasses import asdict
+from typing import Optional, Dict, Any
+
+from services.image_processor import ImageProcessor
+from services.tb_analyzer import TBAnalyzer
+from services.results_store import ResultsStore
+from services.duplicate_index import DuplicateIndex
+from services.triage_router import TriageRouter
+from services.preprocess_pool import PreprocessPool
+from services.lru_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+class AnalysisPipeline:
+    """ImageProcessor -> MedGemmaModel -> TBAnalyzer for one saved image.
+
+    Shared by the HTTP API and the folder ingestion daemon. `upload` arguments
+    are anything with `path` and `image_hash` attributes (a SavedUpload).
+    """
+
+    def __init__(
+        self,
+        image_processor: ImageProcessor,
+        tb_analyzer: TBAnalyzer,
+        results_store: ResultsStore,
+        duplicate_index: DuplicateIndex,
+        triage_router: TriageRouter,
+        model=None,
+        preprocess_pool: Optional[PreprocessPool] = None
+    ):
+        self.image_processor = image_processor
+        self.tb_analyzer = tb_analyzer
+        self.results_store = results_store
+        self.duplicate_index = duplicate_index
+        self.triage_router = triage_router
+        self.model = model
+        self.preprocess_pool = preprocess_pool
+        # Prepared model inputs per (image hash, preset), and decoded grayscale sources per image hash
+        self.prepared_cache = LRUCache(int(os.getenv("PREPROCESS_CACHE_ENTRIES", "32")))
+        self.source_cache = LRUCache(
+            int(os.getenv("PREPROCESS_SOURCE_CACHE_ENTRIES", "4")),
+            int(float(os.getenv("PREPROCESS_SOURCE_CACHE_MB", "64")) * 1024 * 1024)
+        )
+
+    def persist_result(self, upload, filename, raw_report, tb_analysis, inference_ms, total_ms) -> Optional[str]:
+        """Queue a result for the results store; never fails the analysis request"""
+        try:
+            info = self.model.get_model_info() if self.model else {}
+            return self.results_store.record(
+                image_hash=upload.image_hash,
+                filename=filename,
+                raw_report=raw_report,
+                tb_analysis=tb_analysis,
+                model_name=info.get("model_name"),
+                model_version=info.get("model_revision"),
+                inference_ms=inference_ms,
+                total_ms=total_ms
+            )
+        except Exception as e:
+            logger.error(f"Failed to queue result for persistence: {e}")
+            return None
+
+    async def prepare(self, upload, preset: Optional[str] = None) -> Dict[str, Any]:
+        """Quality-gate and preprocess a saved upload, then look it up in the near-duplicate index.
+
+        Re-running an image under a preset it was already prepared with skips
+        preprocessing entirely; trying another preset reuses the decoded
+        source when it was prepared in-process.
+        """
+        preset = self.image_processor.resolve_preset(preset)
+        cache_key = (upload.image_hash, preset)
+        cached = self.prepared_cache.get(cache_key)
+
+        if cached:
+            processed_image, quality, perceptual_hash = cached
+            self.image_processor.record_quality_stats(quality)
+        elif self.preprocess_pool:
+            processed_image, quality, perceptual_hash = await self.preprocess_pool.preprocess(upload.path, preset)
+            self.image_processor.record_quality_stats(quality)
+            self.image_processor.enforce_quality(quality)
+        else:
+            source = self.source_cache.get(upload.image_hash)
+            if source:
+                gray, quality = source
+                self.image_processor.record_quality_stats(quality)
+                self.image_processor.enforce_quality(quality)
+            else:
+                image = self.image_processor.load_image(upload.path)
+                quality = self.image_processor.check_quality(image)
+                gray = self.image_processor.to_grayscale(image)
+                del image
+                self.source_cache.put(upload.image_hash, (gray, quality), gray.nbytes)
+            processed_image = self.image_processor.prepare_grayscale(gray, preset)
+            perceptual_hash = self.image_processor.compute_perceptual_hash(processed_image)
+
+        if not cached:
+            self.prepared_cache.put(
+                cache_key, (processed_image, quality, perceptual_hash),
+                processed_image.width * processed_image.height * len(processed_image.getbands())
+            )
+
+        return {
+            "processed_image": processed_image,
+            "perceptual_hash": perceptual_hash,
+            "preset": preset,
+            "quality": quality,
+            "match": self.duplicate_index.find(perceptual_hash, preset)
+        }
+
+    def get_cache_stats(self) -> Dict[str, Any]:
+        return {
+            "prepared": self.prepared_cache.get_stats(),
+            "sources": self.source_cache.get_stats()
+        }
+
+    def complete(self, upload, filename, prepared, result, tb_analysis, inference_ms, start_time, triage=None) -> Dict[str, Any]:
+        """Persist a finished analysis, index it for near-duplicate reuse and build the response body"""
+        match = prepared["match"]
+        duplicate_of = None
+        if match:
+            duplicate_of = {
+                "result_id": match["payload"]["result_id"],
+                "similarity": match["similarity"],
+                "hamming_distance": match["hamming_distance"]
+            }
+
+        result_id = self.persist_result(
+            upload, filename, result, tb_analysis,
+            inference_ms, (time.perf_counter() - start_time) * 1000
+        )
+
+        if not match:
+            self.duplicate_index.add(prepared["perceptual_hash"], {
+                "result_id": result_id,
+                "raw_report": result,
+                "tb_analysis": tb_analysis
+            }, prepared["preset"])
+
+        return {
+            "result_id": result_id,
+            "image_hash": upload.image_hash,
+            "perceptual_hash": f"{prepared['perceptual_hash']:016x}",
+            "preset": prepared["preset"],
+            "raw_report": result,
+            "tb_analysis": tb_analysis,
+            "reused_result": duplicate_of is not None,
+            "duplicate_of": duplicate_of,
+            "quality": asdict(prepared["quality"]),
+            "triage": triage
+        }
+
+    async def screen(self, prepared) -> Dict[str, Any]:
+        return await self.triage_router.screen(self.model, prepared["processed_image"])
+
+    def complete_screening(self, upload, filename, prepared, triage, inference_start, start_time) -> Dict[str, Any]:
+        """Complete an analysis for a film the triage pass cleared without a full report"""
+        return self.complete(
+            upload, filename, prepared,
+            self.triage_router.screening_report(triage),
+            self.tb_analyzer.analyze_screening(triage["suspicion_score"]),
+            (time.perf_counter() - inference_start) * 1000, start_time, triage
+        )
+
+    async def run(self, upload, filename, preset: Optional[str] = None) -> Dict[str, Any]:
+        """Analyse a saved upload, reusing a near-duplicate result instead of calling the model when possible"""
+        start_time = time.perf_counter()
+        prepared = await self.prepare(upload, preset)
+
+        match = prepared["match"]
+        if match:
+            prior = match["payload"]
+            logger.info(f"Reusing result {prior['result_id']} for near-duplicate image (similarity {match['similarity']})")
+            return self.complete(
+                upload, filename, prepared, prior["raw_report"], prior["tb_analysis"], 0.0, start_time
+            )
+
+        inference_start = time.perf_counter()
+        triage = await self.screen(prepared)
+        if not triage["escalate"]:
+            return self.complete_screening(upload, filename, prepared, triage, inference_start, start_time)
+
+        report_start = time.perf_counter()
+        result = await self.model.analyze_image(prepared["processed_image"])
+        self.triage_router.record_full_report((time.perf_counter() - report_start) * 1000)
+        inference_ms = (time.perf_counter() - inference_start) * 1000
+        tb_analysis = self.tb_analyzer.analyze_for_tb(result)
+
+        return self.complete(upload, filename, prepared, result, tb_analysis, inference_ms, start_time, triage)
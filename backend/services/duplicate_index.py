@@ -0,0 +1,129 @@
+import threading
+import logging
+import os
+from typing import Optional, Dict, Any, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+HASH_BITS = 64
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+class BKTree:
+    """Burkhard-Keller tree over 64-bit hashes using Hamming distance.
+
+    Lookups within a small radius only visit children whose edge distance lies
+    in [d - radius, d + radius], which prunes most of the tree.
+    """
+
+    def __init__(self):
+        self.root: Optional[list] = None
+        self.size = 0
+
+    def add(self, value: int, payload: Any):
+        # Nodes are [value, payload, {distance: child}]
+        node = [value, payload, {}]
+        self.size += 1
+        if self.root is None:
+            self.root = node
+            return
+
+        current = self.root
+        while True:
+            distance = hamming_distance(value, current[0])
+            if distance == 0:
+                # Same hash: keep the most recent payload
+                current[1] = payload
+                self.size -= 1
+                return
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def search(self, value: int, radius: int) -> List[Tuple[int, Any]]:
+        """Return (distance, payload) pairs within radius, closest first"""
+        if self.root is None:
+            return []
+
+        matches = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(value, node[0])
+            if distance <= radius:
+                matches.append((distance, node[1]))
+            for edge, child in node[2].items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+class DuplicateIndex:
+    """In-memory index of perceptual hashes of previously analysed images.
+
+    Hashes live in separate namespaces (one per preprocessing preset), so a
+    result is only reused for an image prepared the same way.
+    """
+
+    def __init__(self):
+        self.similarity_threshold = float(os.getenv("DUPLICATE_SIMILARITY_THRESHOLD", "0.9"))
+        self.max_entries = int(os.getenv("DUPLICATE_INDEX_MAX_ENTRIES", "10000"))
+        self.enabled = os.getenv("DUPLICATE_DETECTION_ENABLED", "true").lower() == "true"
+        self._trees: Dict[str, BKTree] = {}
+        self._entries: List[Tuple[str, int, Dict[str, Any]]] = []
+        self._lock = threading.Lock()
+        self.stats = {"lookups": 0, "hits": 0}
+
+    @property
+    def max_distance(self) -> int:
+        return int((1.0 - self.similarity_threshold) * HASH_BITS)
+
+    def find(self, perceptual_hash: int, namespace: str = "default") -> Optional[Dict[str, Any]]:
+        """Return the closest prior result within the similarity threshold, if any"""
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            self.stats["lookups"] += 1
+            tree = self._trees.get(namespace)
+            matches = tree.search(perceptual_hash, self.max_distance) if tree else []
+            if not matches:
+                return None
+            self.stats["hits"] += 1
+
+        distance, payload = matches[0]
+        return {
+            "payload": payload,
+            "hamming_distance": distance,
+            "similarity": round(1.0 - distance / HASH_BITS, 4)
+        }
+
+    def add(self, perceptual_hash: int, payload: Dict[str, Any], namespace: str = "default"):
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._entries.append((namespace, perceptual_hash, payload))
+            self._trees.setdefault(namespace, BKTree()).add(perceptual_hash, payload)
+
+            if len(self._entries) > self.max_entries:
+                # BK-trees don't support deletion; drop the oldest half and rebuild
+                self._entries = self._entries[len(self._entries) // 2:]
+                self._trees = {}
+                for entry_namespace, value, entry_payload in self._entries:
+                    self._trees.setdefault(entry_namespace, BKTree()).add(value, entry_payload)
+                logger.info(f"Duplicate index trimmed to {len(self._entries)} entries")
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "entries": sum(tree.size for tree in self._trees.values()),
+                "similarity_threshold": self.similarity_threshold,
+                "max_hamming_distance": self.max_distance,
+                **self.stats
+            }
@@ -0,0 +1,294 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Dict, Any, Set, Tuple
+
+from services.analysis_pipeline import AnalysisPipeline
+from services.image_processor import ImageQualityError, ImageTooLargeError, ImageDecodeError
+from services.upload_handler import UploadHandler, UploadRejectedError, SavedUpload
+
+logger = logging.getLogger(__name__)
+
+try:
+    # Optional: event-driven watching on Linux; falls back to polling without it
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:
+    INotify = None
+
+IGNORED_SUFFIXES = ('.part', '.tmp', '.partial', '.json')
+
+# Problems with the file itself; anything else (endpoint errors, timeouts) is retried
+INPUT_ERRORS = (UploadRejectedError, ImageQualityError, ImageTooLargeError, ImageDecodeError)
+
+def _atomic_write_json(path: Path, data: Dict[str, Any]):
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def _atomic_move(source: Path, destination: Path):
+    try:
+        os.replace(source, destination)
+    except OSError:
+        # Different filesystem: copy under a hidden name, then rename into place
+        tmp_path = destination.with_name(f".{destination.name}.tmp")
+        shutil.copy2(source, tmp_path)
+        os.replace(tmp_path, destination)
+        os.unlink(source)
+
+class FolderIngestor:
+    """Watches a drop directory and runs new images through the analysis pipeline.
+
+    Each processed image is moved to processed_dir next to a `<name>.json`
+    sidecar (or to failed_dir with `<name>.error.json`). Sidecars are written
+    before the image is moved, so after a crash the next start sees a sidecar
+    with a matching hash and only finishes the move instead of re-running
+    inference. Results are also appended to a JSONL results file if configured.
+    Input errors (unsupported, undecodable or unusable films) send a film
+    straight to failed_dir. After model or endpoint errors it stays in the
+    watch directory and is retried with exponential backoff, starting at
+    poll_interval and capped at retry_max_delay, until max_attempts.
+    """
+
+    def __init__(
+        self,
+        pipeline: AnalysisPipeline,
+        watch_dir: str,
+        processed_dir: str,
+        failed_dir: str,
+        concurrency: int = 2,
+        poll_interval: float = 5.0,
+        settle_seconds: float = 2.0,
+        results_file: Optional[str] = None,
+        max_attempts: int = 10,
+        retry_max_delay: float = 600.0
+    ):
+        self.pipeline = pipeline
+        self.watch_dir = Path(watch_dir)
+        self.processed_dir = Path(processed_dir)
+        self.failed_dir = Path(failed_dir)
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.settle_seconds = settle_seconds
+        self.results_file = Path(results_file) if results_file else None
+        self.max_attempts = max_attempts
+        self.retry_max_delay = retry_max_delay
+        self.upload_handler = UploadHandler()
+        self.stats = {'processed': 0, 'failed': 0, 'resumed': 0, 'retried': 0}
+        self._queue: Optional[asyncio.Queue] = None
+        self._queued: Set[str] = set()
+        # path -> (failed attempts, monotonic time of the next allowed attempt)
+        self._retries: Dict[str, Tuple[int, float]] = {}
+        self._results_lock = threading.Lock()
+        self._stopping = asyncio.Event()
+
+    async def run(self):
+        for directory in (self.watch_dir, self.processed_dir, self.failed_dir):
+            directory.mkdir(parents=True, exist_ok=True)
+
+        self._queue = asyncio.Queue()
+        workers = [asyncio.create_task(self._worker(i)) for i in range(self.concurrency)]
+
+        # Pick up anything dropped while we were down
+        self._scan()
+
+        watcher = self._watch_inotify() if INotify is not None else self._watch_polling()
+        logger.info(
+            f"Watching {self.watch_dir} ({'inotify' if INotify is not None else 'polling'}) "
+            f"with concurrency {self.concurrency}"
+        )
+        try:
+            await watcher
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    def stop(self):
+        self._stopping.set()
+
+    def _is_candidate(self, path: Path) -> bool:
+        return (
+            path.is_file()
+            and not path.name.startswith('.')
+            and not path.name.lower().endswith(IGNORED_SUFFIXES)
+        )
+
+    def _scan(self):
+        paths = sorted(self.watch_dir.iterdir())
+        # Forget retry state for films that were removed while backing off
+        present = {str(path) for path in paths}
+        for stale in [key for key in self._retries if key not in present]:
+            del self._retries[stale]
+        for path in paths:
+            self._enqueue(path)
+
+    def _enqueue(self, path: Path):
+        if str(path) in self._queued or not self._is_candidate(path):
+            return
+        retry = self._retries.get(str(path))
+        if retry and time.monotonic() < retry[1]:
+            return
+        self._queued.add(str(path))
+        self._queue.put_nowait(path)
+
+    async def _watch_polling(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                self._scan()
+
+    async def _watch_inotify(self):
+        inotify = INotify()
+        inotify.add_watch(str(self.watch_dir), inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO)
+        loop = asyncio.get_running_loop()
+        next_scan = time.monotonic() + self.poll_interval
+        try:
+            while not self._stopping.is_set():
+                # Blocking read in a thread; the timeout lets us notice stop()
+                events = await loop.run_in_executor(None, lambda: inotify.read(timeout=1000))
+                for event in events:
+                    if event.name:
+                        self._enqueue(self.watch_dir / event.name)
+                # Files written from another host onto an NFS/SMB share raise no
+                # events, and IN_Q_OVERFLOW drops them, so rescan periodically too
+                if time.monotonic() >= next_scan:
+                    self._scan()
+                    next_scan = time.monotonic() + self.poll_interval
+        finally:
+            inotify.close()
+
+    async def _wait_until_settled(self, path: Path) -> bool:
+        """Wait until the file has stopped growing, in case the exporter is still writing it"""
+        while True:
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                return False
+            age = time.time() - stat.st_mtime
+            if age >= self.settle_seconds:
+                return True
+            await asyncio.sleep(self.settle_seconds - age)
+
+    async def _worker(self, worker_id: int):
+        while True:
+            path = await self._queue.get()
+            try:
+                if await self._wait_until_settled(path):
+                    await self._process(path)
+            except Exception as e:
+                logger.error(f"Worker {worker_id} failed on {path.name}: {e}")
+            finally:
+                self._queued.discard(str(path))
+                self._queue.task_done()
+
+    def _hash_file(self, path: Path) -> str:
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.upload_handler.chunk_size), b''):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def _destination(self, directory: Path, path: Path, image_hash: str) -> Path:
+        destination = directory / path.name
+        if destination.exists():
+            # Don't overwrite an earlier film that happened to have the same name
+            destination = directory / f"{path.stem}-{image_hash[:8]}{path.suffix}"
+        return destination
+
+    def _sidecar_path(self, image_path: Path, suffix: str = '.json') -> Path:
+        return image_path.with_name(image_path.name + suffix)
+
+    def _find_completed_sidecar(self, path: Path, image_hash: str) -> Optional[Path]:
+        for candidate in (self.processed_dir / path.name, self.processed_dir / f"{path.stem}-{image_hash[:8]}{path.suffix}"):
+            sidecar = self._sidecar_path(candidate)
+            if sidecar.exists() and not candidate.exists():
+                try:
+                    with open(sidecar) as f:
+                        if json.load(f).get('image_hash') == image_hash:
+                            return candidate
+                except (OSError, ValueError):
+                    continue
+        return None
+
+    async def _process(self, path: Path):
+        image_hash = await asyncio.to_thread(self._hash_file, path)
+
+        completed = self._find_completed_sidecar(path, image_hash)
+        if completed:
+            _atomic_move(path, completed)
+            self.stats['resumed'] += 1
+            logger.info(f"Finished interrupted move for {path.name}")
+            return
+
+        with open(path, 'rb') as f:
+            sniffed = self.upload_handler.sniff_image_format(f.read(UploadHandler.SIGNATURE_LENGTH))
+
+        try:
+            if sniffed is None:
+                raise UploadRejectedError(415, "Unsupported file type")
+            upload = SavedUpload(
+                path=str(path),
+                image_hash=image_hash,
+                size=path.stat().st_size,
+                image_format=sniffed[0]
+            )
+            analysis = await self.pipeline.run(upload, path.name)
+        except INPUT_ERRORS as e:
+            self._move_to_failed(path, image_hash, str(e))
+            return
+        except Exception as e:
+            attempts = self._retries.get(str(path), (0, 0.0))[0] + 1
+            if attempts >= self.max_attempts:
+                self._move_to_failed(path, image_hash, f"Gave up after {attempts} attempts: {e}")
+                return
+            # Left in the watch directory; a scan after the backoff picks it up again
+            delay = min(self.retry_max_delay, self.poll_interval * 2 ** (attempts - 1))
+            self._retries[str(path)] = (attempts, time.monotonic() + delay)
+            self.stats['retried'] += 1
+            logger.warning(f"Analysis of {path.name} failed (attempt {attempts}), retrying in {delay:.1f}s: {e}")
+            return
+
+        self._retries.pop(str(path), None)
+        record = {
+            'filename': path.name,
+            'processed_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            **analysis
+        }
+        destination = self._destination(self.processed_dir, path, image_hash)
+        _atomic_write_json(self._sidecar_path(destination), record)
+        if self.results_file:
+            self._append_result(record)
+        _atomic_move(path, destination)
+
+        self.stats['processed'] += 1
+        logger.info(f"Processed {path.name}: {analysis['tb_analysis'].get('tb_risk_level')}")
+
+    def _move_to_failed(self, path: Path, image_hash: str, error: str):
+        self._retries.pop(str(path), None)
+        destination = self._destination(self.failed_dir, path, image_hash)
+        _atomic_write_json(self._sidecar_path(destination, '.error.json'), {
+            'filename': path.name,
+            'image_hash': image_hash,
+            'error': error,
+            'processed_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        })
+        _atomic_move(path, destination)
+        self.stats['failed'] += 1
+        logger.warning(f"Failed to analyse {path.name}: {error}")
+
+    def _append_result(self, record: Dict[str, Any]):
+        with self._results_lock:
+            with open(self.results_file, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
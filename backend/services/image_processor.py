@@ -1,26 +1,92 @@
-from PIL import Image, ImageEnhance, ImageFilter
+from PIL import Image, ImageFilter
 import cv2
 import numpy as np
-from typing import Tuple, Optional
+from typing import Tuple, Optional, List, Dict, Any
+from dataclasses import dataclass, field
+import threading
 import logging
+import json
+import time
+import os
 
 logger = logging.getLogger(__name__)
 
+class ImageTooLargeError(ValueError):
+    pass
+
+class ImageDecodeError(ValueError):
+    """The file has a valid header but its pixel data can't be decoded (e.g. truncated)"""
+    pass
+
+@dataclass
+class QualityReport:
+    usable: bool
+    reasons: List[str] = field(default_factory=list)
+    warnings: List[str] = field(default_factory=list)
+    metrics: Dict[str, float] = field(default_factory=dict)
+    classifier_score: Optional[float] = None
+    elapsed_ms: float = 0.0
+
+class ImageQualityError(ValueError):
+    def __init__(self, report: QualityReport):
+        super().__init__(f"Image rejected by quality gate: {', '.join(report.reasons)}")
+        self.report = report
+
+ENHANCEMENT_PRESETS = ('legacy', 'clahe', 'windowed', 'lung_crop')
+
+# Keys of QualityReport.metrics, which a quality classifier's features must come from
+QUALITY_METRICS = ('aspect_ratio', 'color_deviation', 'mean', 'std', 'p1', 'p99', 'clipped_fraction', 'edge_density')
+
 class ImageProcessor:
     def __init__(self):
         self.target_size = (512, 512)
         self.supported_formats = ['.jpg', '.jpeg', '.png', '.bmp', '.tiff']
+        self.max_image_pixels = int(os.getenv("MAX_IMAGE_PIXELS", "50000000"))
+        # Let PIL refuse anything far beyond our own cap as a second line of defence
+        Image.MAX_IMAGE_PIXELS = self.max_image_pixels
+        
+        # Quality gate: "reject" stops unusable images, "flag" only reports them, "off" skips it.
+        # Defaults to flag until the thresholds have been validated on real CXR exports.
+        self.quality_gate_mode = os.getenv("QUALITY_GATE_MODE", "flag").lower()
+        self.quality_thresholds = {
+            'min_aspect_ratio': 0.5,
+            'max_aspect_ratio': 2.0,
+            'max_color_deviation': 12.0,
+            'blank_std': 2.0,
+            'min_std': 12.0,
+            'max_dark_p99': 60.0,
+            'min_bright_p1': 200.0,
+            'max_clipped_fraction': 0.5,
+            'min_edge_density': 0.002,
+            'max_edge_density': 0.25
+        }
+        self.quality_classifier = self._load_quality_classifier(os.getenv("QUALITY_CLASSIFIER_PATH"))
+        self._quality_lock = threading.Lock()
+        self.quality_stats: Dict[str, Any] = {'checked': 0, 'rejected': 0, 'flagged': 0, 'reasons': {}}
+        
+        # Enhancement presets, selectable per request; all run on the fitted grayscale image
+        self.default_preset = os.getenv("PREPROCESS_PRESET", "legacy").lower()
+        if self.default_preset not in ENHANCEMENT_PRESETS:
+            logger.warning(f"Unknown PREPROCESS_PRESET '{self.default_preset}', using 'legacy'")
+            self.default_preset = 'legacy'
+        self.enhancement_params = {
+            'legacy_contrast': 1.2,
+            'legacy_sharpness': 1.1,
+            'legacy_brightness': 1.05,
+            'clahe_clip_limit': float(os.getenv("CLAHE_CLIP_LIMIT", "2.0")),
+            'clahe_tile_grid': int(os.getenv("CLAHE_TILE_GRID", "8")),
+            'window_low_percentile': 0.5,
+            'window_high_percentile': 99.5,
+            'lung_crop_margin': 0.05,
+            'lung_crop_min_fraction': 0.25
+        }
+        self._build_operators()
     
-    def preprocess_image(self, image_path: str) -> Image.Image:
+    def preprocess_image(self, image_path: str, preset: Optional[str] = None) -> Image.Image:
         try:
-            image = Image.open(image_path)
+            image = self.load_image(image_path)
             
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            processed_image = self._enhance_image(image)
-            
-            processed_image = self._resize_image(processed_image)
+            processed_image = self.prepare_image(image, preset)
             
             logger.info(f"Image preprocessed successfully: {image_path}")
             return processed_image
@@ -29,41 +95,385 @@ class ImageProcessor:
             logger.error(f"Error preprocessing image {image_path}: {e}")
             raise e
     
-    def _enhance_image(self, image: Image.Image) -> Image.Image:
+    def load_image(self, image_path: str) -> Image.Image:
+        """Open an image with the dimension cap enforced.
+        
+        8-bit grayscale images (nearly every CXR export) stay single-channel;
+        everything else is converted to RGB.
+        """
         try:
-            enhancer = ImageEnhance.Contrast(image)
-            image = enhancer.enhance(1.2)
-            
-            enhancer = ImageEnhance.Sharpness(image)
-            image = enhancer.enhance(1.1)
-            
-            enhancer = ImageEnhance.Brightness(image)
-            image = enhancer.enhance(1.05)
-            
-            return image
-            
-        except Exception as e:
-            logger.warning(f"Image enhancement failed, using original: {e}")
-            return image
+            image = Image.open(image_path)
+        except Image.DecompressionBombError as e:
+            raise ImageTooLargeError(str(e))
+        except FileNotFoundError:
+            raise
+        except OSError as e:
+            raise ImageDecodeError(f"Could not read image: {e}")
+        
+        # Image.open only parses the header, so this runs before pixel decoding
+        self._check_dimensions(image)
+        
+        try:
+            if image.mode not in ('L', 'RGB'):
+                image = image.convert('RGB')
+            else:
+                image.load()
+        except OSError as e:
+            # Pillow raises a plain OSError for truncated or corrupt pixel data
+            raise ImageDecodeError(f"Could not decode image: {e}")
+        
+        return image
+    
+    def prepare_image(self, image: Image.Image, preset: Optional[str] = None) -> Image.Image:
+        """Enhance and letterbox a loaded image to the model input size (RGB)"""
+        return self.prepare_grayscale(self.to_grayscale(image), preset)
+    
+    def prepare_grayscale(self, gray: np.ndarray, preset: Optional[str] = None) -> Image.Image:
+        """prepare_image for an image already reduced to 8-bit grayscale with to_grayscale"""
+        out = np.empty((self.target_size[1], self.target_size[0], 3), dtype=np.uint8)
+        self._render_checked(gray, self.resolve_preset(preset), out)
+        return Image.fromarray(out)
+    
+    def to_grayscale(self, image: Image.Image) -> np.ndarray:
+        """The single-channel array every preset starts from"""
+        return np.asarray(image if image.mode == 'L' else image.convert('L'))
+    
+    def resolve_preset(self, preset: Optional[str]) -> str:
+        """Normalise a requested preset name, falling back to the configured default"""
+        preset = (preset or self.default_preset).lower()
+        if preset not in ENHANCEMENT_PRESETS:
+            raise ValueError(f"Unknown preprocessing preset '{preset}'; expected one of {', '.join(ENHANCEMENT_PRESETS)}")
+        return preset
+    
+    def assess_quality(self, image: Image.Image, record_stats: bool = True) -> QualityReport:
+        """Cheap local checks for non-CXR or unusable images, run before remote inference"""
+        start_time = time.perf_counter()
+        
+        if self.quality_gate_mode == 'off':
+            return QualityReport(usable=True)
+        
+        thresholds = self.quality_thresholds
+        reasons = []
+        warnings = []
+        
+        width, height = image.size
+        aspect_ratio = width / height
+        
+        # All pixel statistics are computed on a ~256px reduction of the image
+        factor = max(1, max(width, height) // 256)
+        small = np.asarray(image.reduce(factor) if factor > 1 else image)
+        
+        if small.ndim == 2:
+            color_deviation = 0.0
+            gray = small
+        else:
+            channels = small.astype(np.int16)
+            color_deviation = float(
+                (np.abs(channels[..., 0] - channels[..., 1]) + np.abs(channels[..., 1] - channels[..., 2])).mean() / 2
+            )
+            gray = cv2.cvtColor(small, cv2.COLOR_RGB2GRAY)
+        histogram = np.bincount(gray.ravel(), minlength=256)
+        cdf = np.cumsum(histogram) / gray.size
+        p1 = float(np.searchsorted(cdf, 0.01))
+        p99 = float(np.searchsorted(cdf, 0.99))
+        mean = float(gray.mean())
+        std = float(gray.std())
+        clipped_fraction = float((histogram[0] + histogram[255]) / gray.size)
+        
+        edges = cv2.Canny(gray, 50, 150)
+        edge_density = float(np.count_nonzero(edges) / edges.size)
+        
+        metrics = {
+            'aspect_ratio': round(aspect_ratio, 4),
+            'color_deviation': round(color_deviation, 4),
+            'mean': round(mean, 4),
+            'std': round(std, 4),
+            'p1': p1,
+            'p99': p99,
+            'clipped_fraction': round(clipped_fraction, 4),
+            'edge_density': round(edge_density, 4)
+        }
+        
+        if not thresholds['min_aspect_ratio'] <= aspect_ratio <= thresholds['max_aspect_ratio']:
+            reasons.append('unusual_aspect_ratio')
+        if color_deviation > thresholds['max_color_deviation']:
+            reasons.append('not_grayscale')
+        if std < thresholds['blank_std']:
+            reasons.append('blank_or_uniform')
+        elif p99 < thresholds['max_dark_p99']:
+            reasons.append('underexposed')
+        elif p1 > thresholds['min_bright_p1']:
+            reasons.append('overexposed')
+        elif std < thresholds['min_std']:
+            reasons.append('low_contrast')
+        if clipped_fraction > thresholds['max_clipped_fraction']:
+            warnings.append('heavy_clipping')
+        if edge_density < thresholds['min_edge_density']:
+            warnings.append('low_detail')
+        elif edge_density > thresholds['max_edge_density']:
+            warnings.append('high_edge_density')
+        
+        classifier_score = None
+        if self.quality_classifier:
+            classifier_score = self._score_quality_classifier(metrics)
+            if classifier_score < self.quality_classifier['threshold']:
+                reasons.append('classifier_rejected')
+        
+        report = QualityReport(
+            usable=not reasons,
+            reasons=reasons,
+            warnings=warnings,
+            metrics=metrics,
+            classifier_score=classifier_score,
+            elapsed_ms=round((time.perf_counter() - start_time) * 1000, 3)
+        )
+        if record_stats:
+            self.record_quality_stats(report)
+        return report
+    
+    def check_quality(self, image: Image.Image) -> QualityReport:
+        """Assess quality and raise ImageQualityError if the gate is in reject mode"""
+        return self.enforce_quality(self.assess_quality(image))
+    
+    def enforce_quality(self, report: QualityReport) -> QualityReport:
+        if not report.usable and self.quality_gate_mode == 'reject':
+            raise ImageQualityError(report)
+        return report
+    
+    def record_quality_stats(self, report: QualityReport):
+        with self._quality_lock:
+            self.quality_stats['checked'] += 1
+            if report.usable:
+                return
+            if self.quality_gate_mode == 'reject':
+                self.quality_stats['rejected'] += 1
+            else:
+                self.quality_stats['flagged'] += 1
+            for reason in report.reasons:
+                self.quality_stats['reasons'][reason] = self.quality_stats['reasons'].get(reason, 0) + 1
     
-    def _resize_image(self, image: Image.Image) -> Image.Image:
+    def get_quality_stats(self) -> Dict[str, Any]:
+        with self._quality_lock:
+            return {
+                'mode': self.quality_gate_mode,
+                'classifier_loaded': self.quality_classifier is not None,
+                'checked': self.quality_stats['checked'],
+                'rejected': self.quality_stats['rejected'],
+                'flagged': self.quality_stats['flagged'],
+                'reasons': dict(self.quality_stats['reasons'])
+            }
+    
+    def _load_quality_classifier(self, path: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Load an optional logistic-regression classifier over the quality metrics.
+        
+        The JSON file holds {"features": [...], "weights": [...], "bias": float,
+        "threshold": float}; features name keys of QualityReport.metrics.
+        """
+        if not path:
+            return None
         try:
-            original_size = image.size
-            image.thumbnail(self.target_size, Image.Resampling.LANCZOS)
-            
-            new_image = Image.new('RGB', self.target_size, (0, 0, 0))
-            
-            paste_x = (self.target_size[0] - image.size[0]) // 2
-            paste_y = (self.target_size[1] - image.size[1]) // 2
-            
-            new_image.paste(image, (paste_x, paste_y))
-            
-            logger.debug(f"Image resized from {original_size} to {self.target_size}")
-            return new_image
-            
+            with open(path) as f:
+                config = json.load(f)
+            classifier = {
+                'features': list(config['features']),
+                'weights': np.asarray(config['weights'], dtype=np.float64),
+                'bias': float(config.get('bias', 0.0)),
+                'threshold': float(config.get('threshold', 0.5))
+            }
+            # Checked here so a bad file disables the classifier instead of failing every upload
+            unknown = [name for name in classifier['features'] if name not in QUALITY_METRICS]
+            if unknown:
+                raise ValueError(f"unknown features {unknown}; expected names from {', '.join(QUALITY_METRICS)}")
+            if classifier['weights'].shape != (len(classifier['features']),):
+                raise ValueError(
+                    f"{classifier['weights'].size} weights for {len(classifier['features'])} features"
+                )
+            return classifier
         except Exception as e:
-            logger.error(f"Error resizing image: {e}")
-            raise e
+            logger.warning(f"Could not load quality classifier from {path}, classifier disabled: {e}")
+            return None
+    
+    def _score_quality_classifier(self, metrics: Dict[str, float]) -> float:
+        classifier = self.quality_classifier
+        features = np.asarray([metrics[name] for name in classifier['features']], dtype=np.float64)
+        logit = float(features @ classifier['weights'] + classifier['bias'])
+        return round(1.0 / (1.0 + np.exp(-logit)), 4)
+    
+    def _check_dimensions(self, image: Image.Image):
+        width, height = image.size
+        if width * height > self.max_image_pixels:
+            raise ImageTooLargeError(
+                f"Image dimensions {width}x{height} exceed the maximum of {self.max_image_pixels} pixels"
+            )
+    
+    def _build_operators(self):
+        """Create the preset operators once; they are reused for every image"""
+        params = self.enhancement_params
+        tile_grid = params['clahe_tile_grid']
+        self._clahe = cv2.createCLAHE(clipLimit=params['clahe_clip_limit'], tileGridSize=(tile_grid, tile_grid))
+        # cv2 CLAHE objects keep per-call scratch buffers, so applies are serialised
+        self._clahe_lock = threading.Lock()
+        
+        # PIL's Sharpness blends the image with its SMOOTH filter
+        self._smooth_kernel = np.array([[1, 1, 1], [1, 5, 1], [1, 1, 1]], dtype=np.float32) / 13
+        
+        self._levels = np.arange(256, dtype=np.float32)
+        self._brightness_lut = np.clip(self._levels * params['legacy_brightness'], 0, 255).astype(np.uint8)
+        self._crop_kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+        
+        # legacy is special-cased in _render: it runs before fitting, like the original
+        self._enhancers = {
+            'clahe': self._apply_clahe,
+            'windowed': self._enhance_windowed,
+            'lung_crop': self._apply_clahe
+        }
+    
+    def _render_checked(self, gray: np.ndarray, preset: str, out: np.ndarray):
+        try:
+            self._render(gray, preset, out)
+        except cv2.error as e:
+            # Degenerate pixel data (e.g. a zero-sized image) that OpenCV can't process
+            raise ImageDecodeError(f"Could not process image: {e}")
+    
+    def _render(self, gray: np.ndarray, preset: str, out: np.ndarray):
+        """(Lung crop) -> fit -> enhance -> letterbox a grayscale image into `out` as RGB"""
+        if preset == 'lung_crop':
+            gray = self._crop_lung_field(gray)
+        
+        if preset == 'legacy':
+            # Enhanced at full resolution and resampled as the original PIL chain
+            # did, so the default model input is unchanged
+            enhanced = self._thumbnail(self._enhance_legacy(gray))
+        else:
+            enhanced = self._enhancers[preset](self._fit_to_target(gray))
+        
+        height, width = enhanced.shape
+        top = (out.shape[0] - height) // 2
+        left = (out.shape[1] - width) // 2
+        out[...] = 0
+        # The only 3-channel expansion in the pipeline, written straight into the output
+        out[top:top + height, left:left + width] = enhanced[..., np.newaxis]
+    
+    def _fit_to_target(self, gray: np.ndarray) -> np.ndarray:
+        """Downscale to fit target_size, keeping the aspect ratio and never upscaling"""
+        height, width = gray.shape
+        scale = min(self.target_size[0] / width, self.target_size[1] / height)
+        if scale >= 1.0:
+            return gray
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        return cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+    
+    def _thumbnail(self, gray: np.ndarray) -> np.ndarray:
+        image = Image.fromarray(gray)
+        image.thumbnail(self.target_size, Image.Resampling.LANCZOS)
+        return np.asarray(image)
+    
+    def _enhance_legacy(self, gray: np.ndarray) -> np.ndarray:
+        """The original PIL contrast/sharpness/brightness chain, pixel-identical on grayscale.
+        
+        Contrast and brightness are LUTs; PIL truncates its blends, so the
+        LUTs do too. PIL's SMOOTH filter leaves the 1px border untouched.
+        """
+        params = self.enhancement_params
+        mean = int(gray.mean() + 0.5)
+        contrast_lut = np.clip(mean + (self._levels - mean) * params['legacy_contrast'], 0, 255)
+        contrasted = cv2.LUT(gray, contrast_lut.astype(np.uint8))
+        
+        smoothed = cv2.filter2D(contrasted, -1, self._smooth_kernel).astype(np.float32)
+        sharpened = smoothed + params['legacy_sharpness'] * (contrasted - smoothed)
+        sharpened = np.clip(sharpened, 0, 255).astype(np.uint8)
+        sharpened[[0, -1], :] = contrasted[[0, -1], :]
+        sharpened[:, [0, -1]] = contrasted[:, [0, -1]]
+        
+        return cv2.LUT(sharpened, self._brightness_lut)
+    
+    def _apply_clahe(self, gray: np.ndarray) -> np.ndarray:
+        with self._clahe_lock:
+            return self._clahe.apply(gray)
+    
+    def _enhance_windowed(self, gray: np.ndarray) -> np.ndarray:
+        """Linear window between low/high intensity percentiles, read off the histogram"""
+        params = self.enhancement_params
+        cdf = np.cumsum(np.bincount(gray.ravel(), minlength=256)) / gray.size
+        low = float(np.searchsorted(cdf, params['window_low_percentile'] / 100))
+        high = float(np.searchsorted(cdf, params['window_high_percentile'] / 100))
+        if high <= low:
+            return gray
+        window_lut = np.clip((self._levels - low) * (255.0 / (high - low)), 0, 255)
+        return cv2.LUT(gray, window_lut.astype(np.uint8))
+    
+    def _crop_lung_field(self, gray: np.ndarray) -> np.ndarray:
+        """Crop to the bounding box of the lung fields so borders don't use model resolution.
+        
+        Lungs are the large dark regions inside the body. They are found on a
+        ~256px copy as Otsu-dark components that don't touch the image edge
+        (the air around the patient does). Falls back to the full image when
+        nothing plausible is found.
+        """
+        params = self.enhancement_params
+        height, width = gray.shape
+        scale = min(1.0, 256 / max(height, width))
+        small = cv2.resize(gray, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+        small = cv2.GaussianBlur(small, (5, 5), 0)
+        
+        _, mask = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, self._crop_kernel)
+        count, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+        
+        small_height, small_width = small.shape
+        x0, y0 = stats[1:, cv2.CC_STAT_LEFT], stats[1:, cv2.CC_STAT_TOP]
+        x1 = x0 + stats[1:, cv2.CC_STAT_WIDTH]
+        y1 = y0 + stats[1:, cv2.CC_STAT_HEIGHT]
+        areas = stats[1:, cv2.CC_STAT_AREA]
+        interior = (x0 > 0) & (y0 > 0) & (x1 < small_width) & (y1 < small_height) & (areas >= 0.01 * small.size)
+        if not interior.any():
+            return gray
+        
+        # The two largest interior components are the lungs
+        lungs = np.flatnonzero(interior)[np.argsort(areas[interior])[::-1][:2]]
+        margin = params['lung_crop_margin']
+        left = max(0.0, x0[lungs].min() / small_width - margin)
+        right = min(1.0, x1[lungs].max() / small_width + margin)
+        top = max(0.0, y0[lungs].min() / small_height - margin)
+        bottom = min(1.0, y1[lungs].max() / small_height + margin)
+        if (right - left) * (bottom - top) < params['lung_crop_min_fraction']:
+            return gray
+        
+        return gray[round(top * height):round(bottom * height), round(left * width):round(right * width)]
+    
+    def process_into(self, image_path: str, out: np.ndarray, preset: Optional[str] = None) -> Dict[str, Any]:
+        """Array-native preprocessing for worker processes.
+        
+        Writes the target_size RGB result into `out` (e.g. a view over shared
+        memory) and returns only small metadata. Quality stats are left to the
+        caller, and rejected images skip preprocessing entirely.
+        """
+        image = self.load_image(image_path)
+        quality = self.assess_quality(image, record_stats=False)
+        if not quality.usable and self.quality_gate_mode == 'reject':
+            return {'quality': quality, 'perceptual_hash': None}
+        
+        self._render_checked(self.to_grayscale(image), self.resolve_preset(preset), out)
+        
+        return {
+            'quality': quality,
+            # All three channels are equal, so any one is the grayscale image
+            'perceptual_hash': self._perceptual_hash(out[..., 0])
+        }
+    
+    def compute_perceptual_hash(self, image: Image.Image) -> int:
+        """64-bit DCT perceptual hash (pHash) of a preprocessed image"""
+        return self._perceptual_hash(np.asarray(image.convert('L')))
+    
+    def _perceptual_hash(self, gray: np.ndarray) -> int:
+        small = cv2.resize(gray.astype(np.float32), (32, 32), interpolation=cv2.INTER_AREA)
+        low_freq = cv2.dct(small)[:8, :8].flatten()
+        
+        # Exclude the DC term from the median so overall brightness doesn't dominate
+        median = np.median(low_freq[1:])
+        bits = low_freq > median
+        
+        return int(np.packbits(bits).view('>u8')[0])
     
     def validate_image(self, image_path: str) -> bool:
         try:
@@ -96,17 +506,9 @@ class ImageProcessor:
     
     def apply_clahe(self, image: Image.Image) -> Image.Image:
         try:
-            cv_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-            
-            gray = cv2.cvtColor(cv_image, cv2.COLOR_BGR2GRAY)
-            
-            clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-            enhanced = clahe.apply(gray)
-            
-            enhanced_rgb = cv2.cvtColor(enhanced, cv2.COLOR_GRAY2RGB)
-            
-            return Image.fromarray(enhanced_rgb)
+            gray = np.asarray(image if image.mode == 'L' else image.convert('L'))
+            return Image.fromarray(cv2.cvtColor(self._apply_clahe(gray), cv2.COLOR_GRAY2RGB))
             
         except Exception as e:
             logger.warning(f"CLAHE enhancement failed, using original: {e}")
-            return image
\ No newline at end of file
+            return image
@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import multiprocessing
+import pickle
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict
+from multiprocessing import shared_memory
+from typing import Dict, Any, List, Tuple, Optional
+
+import numpy as np
+from PIL import Image
+
+from services.image_processor import ImageProcessor, QualityReport
+
+logger = logging.getLogger(__name__)
+
+_worker_processor: Optional[ImageProcessor] = None
+
+def _init_worker():
+    global _worker_processor
+    _worker_processor = ImageProcessor()
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 always registers attached blocks with the resource
+        # tracker. Spawned workers share the parent's tracker, where the block
+        # is already registered, so this is a no-op and must not be undone.
+        return shared_memory.SharedMemory(name=name)
+
+def _preprocess_worker(image_path: str, shm_name: str, shape: Tuple[int, int, int], preset: Optional[str]) -> Dict[str, Any]:
+    start_time = time.perf_counter()
+    shm = _attach_shared_memory(shm_name)
+    try:
+        out = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        result = _worker_processor.process_into(image_path, out, preset)
+        del out
+    finally:
+        shm.close()
+
+    return {
+        'quality': asdict(result['quality']),
+        'perceptual_hash': result['perceptual_hash'],
+        'worker_ms': (time.perf_counter() - start_time) * 1000
+    }
+
+class PreprocessPool:
+    """Runs ImageProcessor in worker processes without pickling pixel data.
+
+    Workers read the saved upload straight from its temp file and write the
+    target_size result into a shared-memory block owned by this process, so
+    only the path, block name and a small metadata dict cross the process
+    boundary. Blocks are reused between requests.
+    """
+
+    def __init__(self, max_workers: int, target_size: Tuple[int, int] = (512, 512)):
+        self.shape = (target_size[1], target_size[0], 3)
+        self.block_size = int(np.prod(self.shape))
+        # spawn: the API process runs background threads, which fork doesn't mix well with
+        self._executor = ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker
+        )
+        self.max_workers = max_workers
+        self._free_blocks: List[shared_memory.SharedMemory] = []
+        self._all_blocks: List[shared_memory.SharedMemory] = []
+        self._lock = threading.Lock()
+        self.stats = {'tasks': 0, 'worker_ms': 0.0, 'roundtrip_ms': 0.0, 'ipc_bytes': 0}
+
+    def _acquire_block(self) -> shared_memory.SharedMemory:
+        with self._lock:
+            if self._free_blocks:
+                return self._free_blocks.pop()
+            block = shared_memory.SharedMemory(create=True, size=self.block_size)
+            self._all_blocks.append(block)
+            return block
+
+    def _release_block(self, block: shared_memory.SharedMemory):
+        with self._lock:
+            self._free_blocks.append(block)
+
+    async def preprocess(self, image_path: str, preset: Optional[str] = None) -> Tuple[Optional[Image.Image], QualityReport, Optional[int]]:
+        """Returns (processed_image, quality, perceptual_hash); the image is None if the gate rejected it"""
+        block = self._acquire_block()
+        start_time = time.perf_counter()
+        future = self._executor.submit(_preprocess_worker, image_path, block.name, self.shape, preset)
+        try:
+            result = await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # Cancelling doesn't stop a running worker, which may still write into
+            # the block; it only goes back on the free list once the worker is done
+            future.add_done_callback(lambda _: self._release_block(block))
+            raise
+        except BaseException:
+            self._release_block(block)
+            raise
+
+        try:
+            processed_image = None
+            if result['perceptual_hash'] is not None:
+                # One copy out of the block so it can be reused immediately
+                pixels = np.ndarray(self.shape, dtype=np.uint8, buffer=block.buf)
+                processed_image = Image.fromarray(pixels.copy())
+                del pixels
+        finally:
+            self._release_block(block)
+
+        roundtrip_ms = (time.perf_counter() - start_time) * 1000
+        with self._lock:
+            self.stats['tasks'] += 1
+            self.stats['worker_ms'] += result['worker_ms']
+            self.stats['roundtrip_ms'] += roundtrip_ms
+            self.stats['ipc_bytes'] += len(pickle.dumps((image_path, block.name, self.shape, preset))) + len(pickle.dumps(result))
+
+        return processed_image, QualityReport(**result['quality']), result['perceptual_hash']
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            tasks = self.stats['tasks']
+            return {
+                'workers': self.max_workers,
+                'tasks': tasks,
+                'shared_blocks': len(self._all_blocks),
+                'mean_worker_ms': round(self.stats['worker_ms'] / tasks, 2) if tasks else None,
+                # Time spent outside the worker: dispatch, IPC and copying out of shared memory
+                'mean_overhead_ms': round((self.stats['roundtrip_ms'] - self.stats['worker_ms']) / tasks, 2) if tasks else None,
+                'mean_ipc_bytes': round(self.stats['ipc_bytes'] / tasks) if tasks else None
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for block in self._all_blocks:
+                block.close()
+                block.unlink()
+            self._all_blocks.clear()
+            self._free_blocks.clear()
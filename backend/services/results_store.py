@@ -0,0 +1,220 @@
+import sqlite3
+import threading
+import queue
+import json
+import time
+import uuid
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, List
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id TEXT PRIMARY KEY,
+    image_hash TEXT NOT NULL,
+    filename TEXT,
+    created_at TEXT NOT NULL,
+    tb_risk_level TEXT,
+    tb_risk_score REAL,
+    confidence REAL,
+    raw_report TEXT,
+    tb_analysis TEXT,
+    model_name TEXT,
+    model_version TEXT,
+    inference_ms REAL,
+    total_ms REAL
+);
+CREATE INDEX IF NOT EXISTS idx_results_image_hash ON results (image_hash, created_at);
+CREATE INDEX IF NOT EXISTS idx_results_created_at ON results (created_at);
+CREATE INDEX IF NOT EXISTS idx_results_risk_created ON results (tb_risk_level, created_at);
+"""
+
+_COLUMNS = [
+    "id", "image_hash", "filename", "created_at", "tb_risk_level", "tb_risk_score",
+    "confidence", "raw_report", "tb_analysis", "model_name", "model_version",
+    "inference_ms", "total_ms"
+]
+
+_STOP = object()
+
+def _to_utc_iso(value: datetime) -> str:
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.isoformat(timespec="milliseconds")
+
+class ResultsStore:
+    """Embedded SQLite store for analysis results.
+
+    Writes are queued and flushed in batches by a background thread so that
+    persisting a result never blocks the request that produced it.
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or os.getenv("RESULTS_DB_PATH", "results.db")
+        self.batch_size = int(os.getenv("RESULTS_WRITE_BATCH_SIZE", "50"))
+        self.flush_interval = float(os.getenv("RESULTS_FLUSH_INTERVAL_SECONDS", "0.5"))
+        self._queue: "queue.Queue" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def start(self):
+        directory = os.path.dirname(os.path.abspath(self.db_path))
+        os.makedirs(directory, exist_ok=True)
+
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            conn.commit()
+        finally:
+            conn.close()
+
+        self._writer = threading.Thread(target=self._writer_loop, name="results-writer", daemon=True)
+        self._writer.start()
+        logger.info(f"Results store ready at {self.db_path}")
+
+    def stop(self):
+        if self._writer and self._writer.is_alive():
+            self._queue.put(_STOP)
+            self._writer.join(timeout=10)
+        self._writer = None
+
+    def record(
+        self,
+        image_hash: str,
+        filename: Optional[str],
+        raw_report: str,
+        tb_analysis: Dict[str, Any],
+        model_name: Optional[str] = None,
+        model_version: Optional[str] = None,
+        inference_ms: Optional[float] = None,
+        total_ms: Optional[float] = None
+    ) -> Optional[str]:
+        """Queue a result for persistence and return its ID immediately"""
+        if not self._writer:
+            return None
+
+        result_id = uuid.uuid4().hex
+        row = (
+            result_id,
+            image_hash,
+            filename,
+            _to_utc_iso(datetime.now(timezone.utc)),
+            tb_analysis.get("tb_risk_level"),
+            tb_analysis.get("tb_risk_score"),
+            tb_analysis.get("confidence"),
+            raw_report,
+            json.dumps(tb_analysis),
+            model_name,
+            model_version,
+            inference_ms,
+            total_ms
+        )
+        self._queue.put(row)
+        return result_id
+
+    def _writer_loop(self):
+        conn = self._connect()
+        insert_sql = f"INSERT OR REPLACE INTO results ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' for _ in _COLUMNS)})"
+        stopping = False
+        try:
+            while not stopping:
+                item = self._queue.get()
+                if item is _STOP:
+                    break
+
+                batch = [item]
+                deadline = time.monotonic() + self.flush_interval
+                while len(batch) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    batch.append(item)
+
+                try:
+                    conn.executemany(insert_sql, batch)
+                    conn.commit()
+                    logger.debug(f"Persisted {len(batch)} result(s)")
+                except Exception as e:
+                    logger.error(f"Failed to persist {len(batch)} result(s): {e}")
+                    conn.rollback()
+        finally:
+            conn.close()
+
+    def _row_to_dict(self, row: sqlite3.Row) -> Dict[str, Any]:
+        result = dict(row)
+        result["tb_analysis"] = json.loads(result["tb_analysis"]) if result["tb_analysis"] else None
+        return result
+
+    def get_result(self, result_id: str) -> Optional[Dict[str, Any]]:
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM results WHERE id = ?", (result_id,)).fetchone()
+            return self._row_to_dict(row) if row else None
+        finally:
+            conn.close()
+
+    def get_results_by_hash(self, image_hash: str, limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT * FROM results WHERE image_hash = ? ORDER BY created_at DESC LIMIT ? OFFSET ?",
+                (image_hash, limit, offset)
+            ).fetchall()
+            return [self._row_to_dict(row) for row in rows]
+        finally:
+            conn.close()
+
+    def list_results(
+        self,
+        risk_level: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        limit: int = 20,
+        offset: int = 0
+    ) -> Dict[str, Any]:
+        """List result summaries, newest first, without the full report bodies"""
+        clauses = []
+        params: List[Any] = []
+        if risk_level:
+            clauses.append("tb_risk_level = ?")
+            params.append(risk_level)
+        if since:
+            clauses.append("created_at >= ?")
+            params.append(_to_utc_iso(since))
+        if until:
+            clauses.append("created_at < ?")
+            params.append(_to_utc_iso(until))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+        conn = self._connect()
+        try:
+            total = conn.execute(f"SELECT COUNT(*) FROM results {where}", params).fetchone()[0]
+            rows = conn.execute(
+                f"SELECT id, image_hash, filename, created_at, tb_risk_level, tb_risk_score, confidence, "
+                f"model_name, model_version, inference_ms, total_ms "
+                f"FROM results {where} ORDER BY created_at DESC LIMIT ? OFFSET ?",
+                params + [limit, offset]
+            ).fetchall()
+            return {
+                "results": [dict(row) for row in rows],
+                "total": total,
+                "limit": limit,
+                "offset": offset
+            }
+        finally:
+            conn.close()
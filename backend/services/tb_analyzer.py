@@ -12,6 +12,45 @@ class TBFinding:
     confidence: float
     description: str
 
+class IncrementalTBAnalysis:
+    """Runs TB finding extraction over a report as it is generated.
+    
+    Text is fed in arbitrary chunks; findings are extracted only from
+    sentences that have been completed, so each sentence is analysed once.
+    """
+    
+    def __init__(self, analyzer: 'TBAnalyzer'):
+        self.analyzer = analyzer
+        self.report = ''
+        self._pending = ''
+    
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        """Add generated text and return findings from newly completed sentences"""
+        self.report += text
+        self._pending += text
+        
+        last_boundary = max(self._pending.rfind(mark) for mark in '.!?')
+        if last_boundary == -1:
+            return []
+        
+        completed = self._pending[:last_boundary + 1]
+        self._pending = self._pending[last_boundary + 1:]
+        
+        findings = self.analyzer._extract_findings(completed, completed.lower())
+        return [finding.__dict__ for finding in findings]
+    
+    def provisional(self) -> Dict[str, Any]:
+        """Risk estimate over the text generated so far"""
+        risk_score = self.analyzer._calculate_tb_risk(self.report.lower())
+        return {
+            'tb_risk_level': self.analyzer._get_risk_level(risk_score),
+            'tb_risk_score': risk_score
+        }
+    
+    def finish(self) -> Dict[str, Any]:
+        """Full analysis of the complete report, identical to analyze_for_tb"""
+        return self.analyzer.analyze_for_tb(self.report)
+
 class TBAnalyzer:
     def __init__(self):
         self.tb_keywords = {
@@ -69,6 +108,29 @@ class TBAnalyzer:
                 'error': str(e)
             }
     
+    def analyze_screening(self, suspicion_score: float) -> Dict[str, Any]:
+        """TB analysis for a film cleared by the triage pass without a full report"""
+        confidence = min(0.95, max(0.1, 1.0 - suspicion_score))
+        recommendation = self._generate_recommendation(suspicion_score, confidence)
+        recommendation += (
+            "\n\nℹ️ NOTE: This film was cleared by a fast screening pass; "
+            "no full radiology report was generated."
+        )
+        
+        return {
+            'tb_risk_level': self._get_risk_level(suspicion_score),
+            'tb_risk_score': suspicion_score,
+            'confidence': confidence,
+            'findings': [],
+            'recommendation': recommendation,
+            'keywords_found': {'high_risk': [], 'medium_risk': [], 'low_risk': []},
+            'exclusion_factors': [],
+            'screening_only': True
+        }
+    
+    def start_incremental(self) -> IncrementalTBAnalysis:
+        return IncrementalTBAnalysis(self)
+    
     def _calculate_tb_risk(self, report: str) -> float:
         risk_score = 0.0
         
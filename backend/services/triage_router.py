@@ -0,0 +1,92 @@
+import threading
+import logging
+import time
+import os
+from collections import deque
+from typing import Dict, Any
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+class TriageRouter:
+    """Routes films through a cheap screening pass before the full MedGemma report.
+
+    Films whose screening suspicion score is at or above the threshold (or whose
+    screening answer could not be parsed) are escalated to the full report;
+    the rest are answered from the screening pass alone.
+    """
+
+    TIERS = ('screening', 'full_report')
+
+    def __init__(self):
+        self.enabled = os.getenv("TRIAGE_ENABLED", "false").lower() == "true"
+        self.suspicion_threshold = float(os.getenv("TRIAGE_SUSPICION_THRESHOLD", "0.3"))
+        self.screening_max_tokens = int(os.getenv("TRIAGE_MAX_NEW_TOKENS", "8"))
+        self._lock = threading.Lock()
+        self._latencies = {tier: deque(maxlen=1000) for tier in self.TIERS}
+        self._counts = {tier: 0 for tier in self.TIERS}
+        self._outcomes = {'escalated': 0, 'cleared': 0, 'screening_failed': 0}
+
+    async def screen(self, model, image: Image.Image) -> Dict[str, Any]:
+        """Run the screening tier and decide whether the full report is needed"""
+        if not self.enabled:
+            return {'enabled': False, 'escalate': True}
+
+        start_time = time.perf_counter()
+        try:
+            suspicion_score = await model.screen_image(image, max_new_tokens=self.screening_max_tokens)
+        except Exception as e:
+            logger.warning(f"Screening pass failed, escalating to full report: {e}")
+            suspicion_score = None
+        screening_ms = (time.perf_counter() - start_time) * 1000
+        self._record('screening', screening_ms)
+
+        # Fail safe: anything we can't score goes to the full report
+        escalate = suspicion_score is None or suspicion_score >= self.suspicion_threshold
+        with self._lock:
+            if suspicion_score is None:
+                self._outcomes['screening_failed'] += 1
+            self._outcomes['escalated' if escalate else 'cleared'] += 1
+
+        return {
+            'enabled': True,
+            'escalate': escalate,
+            'suspicion_score': suspicion_score,
+            'threshold': self.suspicion_threshold,
+            'screening_ms': round(screening_ms, 1)
+        }
+
+    def screening_report(self, triage: Dict[str, Any]) -> str:
+        return (
+            f"Screening pass only: suspicion score {triage['suspicion_score']:.2f} is below the "
+            f"escalation threshold of {triage['threshold']:.2f}. Full radiology report not generated."
+        )
+
+    def record_full_report(self, elapsed_ms: float):
+        self._record('full_report', elapsed_ms)
+
+    def _record(self, tier: str, elapsed_ms: float):
+        with self._lock:
+            self._counts[tier] += 1
+            self._latencies[tier].append(elapsed_ms)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            tiers = {}
+            for tier in self.TIERS:
+                latencies = np.asarray(self._latencies[tier])
+                tiers[tier] = {
+                    'count': self._counts[tier],
+                    'mean_ms': round(float(latencies.mean()), 1) if latencies.size else None,
+                    'p50_ms': round(float(np.percentile(latencies, 50)), 1) if latencies.size else None,
+                    'p95_ms': round(float(np.percentile(latencies, 95)), 1) if latencies.size else None
+                }
+            screened = self._outcomes['escalated'] + self._outcomes['cleared']
+            return {
+                'enabled': self.enabled,
+                'suspicion_threshold': self.suspicion_threshold,
+                'tiers': tiers,
+                **self._outcomes,
+                'escalation_rate': round(self._outcomes['escalated'] / screened, 4) if screened else None
+            }
@@ -0,0 +1,330 @@
+import os
+import tempfile
+import hashlib
+import logging
+from typing import Any, Optional, Tuple, Dict, List
+from dataclasses import dataclass
+from fastapi import HTTPException, Request
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+
+try:
+    import python_multipart as multipart
+    from python_multipart.multipart import parse_options_header
+except ModuleNotFoundError:
+    # python-multipart < 0.0.13
+    import multipart
+    from multipart.multipart import parse_options_header
+
+logger = logging.getLogger(__name__)
+
+class UploadRejectedError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+@dataclass
+class SavedUpload:
+    path: str
+    image_hash: str
+    size: int
+    image_format: str
+
+@dataclass
+class ReceivedUpload:
+    """A file part of a multipart request: saved to disk, or rejected with the reason"""
+    filename: str
+    content_type: str
+    upload: Optional[SavedUpload] = None
+    error: Optional[UploadRejectedError] = None
+
+class UploadHandler:
+    # Magic bytes for the formats accepted by ImageProcessor
+    IMAGE_SIGNATURES = [
+        (b'\xff\xd8\xff', 'jpeg', '.jpg'),
+        (b'\x89PNG\r\n\x1a\n', 'png', '.png'),
+        (b'BM', 'bmp', '.bmp'),
+        (b'II*\x00', 'tiff', '.tiff'),
+        (b'MM\x00*', 'tiff', '.tiff'),
+    ]
+    SIGNATURE_LENGTH = 8
+
+    def __init__(self):
+        self.max_upload_bytes = int(float(os.getenv("MAX_UPLOAD_SIZE_MB", "10")) * 1024 * 1024)
+        self.chunk_size = int(os.getenv("UPLOAD_CHUNK_SIZE_KB", "64")) * 1024
+
+    def sniff_image_format(self, header: bytes) -> Optional[Tuple[str, str]]:
+        """Return (format, suffix) if the header bytes match a supported image type"""
+        for signature, image_format, suffix in self.IMAGE_SIGNATURES:
+            if header.startswith(signature):
+                return image_format, suffix
+        return None
+
+    def request_limit(self, max_files: int = 1) -> int:
+        # Allow a little headroom for multipart boundaries and form headers
+        return self.max_upload_bytes * max_files + 64 * 1024
+
+    def exceeds_request_limit(self, content_length: Optional[str], max_files: int = 1) -> bool:
+        """Check a request Content-Length against the limit before the body is read"""
+        if not content_length:
+            return False
+        try:
+            return int(content_length) > self.request_limit(max_files)
+        except ValueError:
+            return False
+
+    def too_large_detail(self) -> str:
+        return f"Upload too large. Maximum size is {self.max_upload_bytes // (1024 * 1024)}MB per file"
+
+    async def receive_uploads(
+        self,
+        request: Request,
+        field_name: str,
+        stop_on_rejection: bool = False
+    ) -> List[ReceivedUpload]:
+        """Parse a multipart body straight into one temporary file per file part.
+
+        Each part's header is sniffed as soon as its first bytes arrive, so an
+        unsupported file is rejected without reading the rest of it; with
+        stop_on_rejection the request is abandoned there and the error raised.
+        Accepted parts are written to disk as they stream in, with the per-file
+        size limit enforced and the SHA-256 computed on the fly. Rejected parts
+        in a batch are skipped and returned with their error. The caller is
+        responsible for removing the temporary files of the uploads returned.
+        """
+        content_type, params = parse_options_header(request.headers.get("content-type", ""))
+        if content_type != b"multipart/form-data" or b"boundary" not in params:
+            raise UploadRejectedError(400, "Expected a multipart/form-data upload")
+
+        receiver = _MultipartReceiver(self, field_name)
+        parser = multipart.MultipartParser(params[b"boundary"], receiver.callbacks())
+        try:
+            async for chunk in request.stream():
+                parser.write(chunk)
+                if stop_on_rejection and receiver.rejection is not None:
+                    raise receiver.rejection
+            parser.finalize()
+        except BaseException:
+            receiver.discard()
+            raise
+
+        if not receiver.parts:
+            raise UploadRejectedError(422, f"No file uploaded in the '{field_name}' field")
+        return [part.result() for part in receiver.parts]
+
+
+class _UploadPart:
+    """One file part being written to its temporary file"""
+
+    def __init__(self, upload_handler: UploadHandler, filename: str, content_type: str):
+        self.upload_handler = upload_handler
+        self.filename = filename
+        self.content_type = content_type
+        self.header = b''
+        self.image_format: Optional[str] = None
+        self.tmp_file = None
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.error: Optional[UploadRejectedError] = None
+        if not content_type.startswith("image/"):
+            self.error = UploadRejectedError(400, "File must be an image")
+
+    def write(self, data: bytes):
+        if self.error is not None:
+            return
+        if self.tmp_file is None:
+            self.header += data
+            if len(self.header) >= UploadHandler.SIGNATURE_LENGTH:
+                self._open()
+            return
+        self._append(data)
+
+    def finish(self):
+        if self.error is None and self.tmp_file is None:
+            if not self.header:
+                self.error = UploadRejectedError(400, "Uploaded file is empty")
+                return
+            self._open()
+        if self.tmp_file is not None:
+            self.tmp_file.close()
+
+    def _open(self):
+        sniffed = self.upload_handler.sniff_image_format(self.header)
+        if sniffed is None:
+            self.error = UploadRejectedError(415, "Unsupported file type. Please upload a JPG, PNG, BMP, or TIFF image.")
+            return
+        self.image_format, suffix = sniffed
+        self.tmp_file = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
+        self._append(self.header)
+
+    def _append(self, data: bytes):
+        self.size += len(data)
+        if self.size > self.upload_handler.max_upload_bytes:
+            self.error = UploadRejectedError(
+                413,
+                f"File too large. Maximum upload size is {self.upload_handler.max_upload_bytes // (1024 * 1024)}MB"
+            )
+            self.discard()
+            return
+        self.sha256.update(data)
+        self.tmp_file.write(data)
+
+    def discard(self):
+        if self.tmp_file is not None:
+            self.tmp_file.close()
+            os.unlink(self.tmp_file.name)
+            self.tmp_file = None
+
+    def result(self) -> ReceivedUpload:
+        upload = None
+        if self.error is None:
+            logger.debug(f"Streamed {self.size} bytes ({self.image_format}) to {self.tmp_file.name}")
+            upload = SavedUpload(
+                path=self.tmp_file.name,
+                image_hash=self.sha256.hexdigest(),
+                size=self.size,
+                image_format=self.image_format
+            )
+        return ReceivedUpload(filename=self.filename, content_type=self.content_type, upload=upload, error=self.error)
+
+
+class _MultipartReceiver:
+    """python-multipart callbacks that route file parts of one field to _UploadPart"""
+
+    def __init__(self, upload_handler: UploadHandler, field_name: str):
+        self.upload_handler = upload_handler
+        self.field_name = field_name
+        self.parts: List[_UploadPart] = []
+        self.current: Optional[_UploadPart] = None
+        self.headers: Dict[bytes, bytes] = {}
+        self.header_field = b''
+        self.header_value = b''
+
+    @property
+    def rejection(self) -> Optional[UploadRejectedError]:
+        return next((part.error for part in self.parts if part.error is not None), None)
+
+    def callbacks(self) -> Dict[str, Any]:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+    def on_part_begin(self):
+        self.current = None
+        self.headers = {}
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self.header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self.header_value += data[start:end]
+
+    def on_header_end(self):
+        self.headers[self.header_field.lower()] = self.header_value
+        self.header_field = b''
+        self.header_value = b''
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self.headers.get(b"content-disposition", b""))
+        # Only file parts of the expected field are kept; other form fields are ignored
+        if options.get(b"name", b"").decode("utf-8", "replace") != self.field_name or b"filename" not in options:
+            return
+        self.current = _UploadPart(
+            self.upload_handler,
+            options[b"filename"].decode("utf-8", "replace"),
+            self.headers.get(b"content-type", b"application/octet-stream").decode("latin-1")
+        )
+        self.parts.append(self.current)
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if self.current is not None:
+            self.current.write(data[start:end])
+
+    def on_part_end(self):
+        if self.current is not None:
+            self.current.finish()
+            self.current = None
+
+    def discard(self):
+        for part in self.parts:
+            part.discard()
+
+
+def multipart_upload_openapi(field_name: str, multiple: bool = False) -> Dict[str, Any]:
+    """OpenAPI request body for endpoints that parse their upload with receive_uploads"""
+    schema = {"type": "string", "format": "binary"}
+    if multiple:
+        schema = {"type": "array", "items": schema}
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {
+                "multipart/form-data": {
+                    "schema": {
+                        "type": "object",
+                        "properties": {field_name: schema},
+                        "required": [field_name]
+                    }
+                }
+            }
+        }
+    }
+
+
+class UploadSizeLimitMiddleware:
+    """ASGI middleware that stops reading upload bodies once they exceed the limit.
+
+    Requests with an oversize Content-Length are rejected before any body is
+    read. Bodies without one (chunked transfer encoding) are counted as they
+    are received, and the request is aborted with 413 once the count passes
+    the limit, before UploadHandler.receive_uploads writes any more of it.
+    """
+
+    def __init__(self, app, upload_handler: UploadHandler, max_files_by_path: Dict[str, int]):
+        self.app = app
+        self.upload_handler = upload_handler
+        self.max_files_by_path = max_files_by_path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.max_files_by_path:
+            await self.app(scope, receive, send)
+            return
+
+        limit = self.upload_handler.request_limit(self.max_files_by_path[scope["path"]])
+        detail = self.upload_handler.too_large_detail()
+        if self.upload_handler.exceeds_request_limit(Headers(scope=scope).get("content-length"), self.max_files_by_path[scope["path"]]):
+            await JSONResponse(status_code=413, content={"detail": detail})(scope, receive, send)
+            return
+
+        received = 0
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # HTTPException passes through FastAPI's body parsing unchanged
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        async def tracking_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except HTTPException as e:
+            if e.status_code != 413 or response_started:
+                raise
+            await JSONResponse(status_code=413, content={"detail": detail})(scope, receive, send)
@@ -4,6 +4,7 @@ import { CssBaseline, Container, Typography, Box, Alert } from '@mui/material';
 import ImageUploader from './components/ImageUploader';
 import ResultsDisplay from './components/ResultsDisplay';
 import Header from './components/Header';
+import StreamingReport from './components/StreamingReport';
 import ApiService from './services/ApiService';
 
 const theme = createTheme({
@@ -32,14 +33,29 @@ function App() {
   const [analysisResult, setAnalysisResult] = useState(null);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState(null);
+  const [streamedReport, setStreamedReport] = useState('');
+  const [provisional, setProvisional] = useState(null);
+  const [streamedFindings, setStreamedFindings] = useState([]);
+
+  const handleStreamEvent = (event) => {
+    if (event.type === 'token') {
+      setStreamedReport((report) => report + event.text);
+    } else if (event.type === 'findings') {
+      setStreamedFindings((findings) => [...findings, ...event.findings]);
+      setProvisional(event.provisional);
+    }
+  };
 
   const handleImageUpload = async (file) => {
     setLoading(true);
     setError(null);
     setAnalysisResult(null);
+    setStreamedReport('');
+    setProvisional(null);
+    setStreamedFindings([]);
 
     try {
-      const result = await ApiService.analyzeImage(file);
+      const result = await ApiService.analyzeImageStream(file, handleStreamEvent);
       setAnalysisResult(result);
     } catch (err) {
       setError(err.message || 'Analysis failed. Please try again.');
@@ -95,8 +111,13 @@ function App() {
                 Analyzing chest X-ray with MedGemma-4B...
               </Typography>
               <Typography variant="body2" color="textSecondary" sx={{ mt: 1 }}>
-                This may take a few moments
+                The report appears below as it is generated
               </Typography>
+              <StreamingReport
+                report={streamedReport}
+                provisional={provisional}
+                findings={streamedFindings}
+              />
             </Box>
           )}
         </Box>
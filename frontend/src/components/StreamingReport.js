@@ -0,0 +1,51 @@
+import React from 'react';
+import { Box, Paper, Typography, Chip, LinearProgress } from '@mui/material';
+
+// Shows the report while MedGemma is still generating it. The risk level is
+// provisional until the final result arrives.
+const StreamingReport = ({ report, provisional, findings }) => {
+  const getRiskColor = (riskLevel) => {
+    switch (riskLevel) {
+      case 'high':
+        return 'error';
+      case 'medium':
+        return 'warning';
+      case 'low':
+        return 'info';
+      default:
+        return 'success';
+    }
+  };
+
+  return (
+    <Paper elevation={2} sx={{ mt: 3, p: 3, textAlign: 'left' }}>
+      <Box sx={{ display: 'flex', alignItems: 'center', justifyContent: 'space-between', mb: 2 }}>
+        <Typography variant="h6">Report (generating)</Typography>
+        {provisional && (
+          <Chip
+            label={`Provisional: ${provisional.tb_risk_level.toUpperCase()} RISK`}
+            color={getRiskColor(provisional.tb_risk_level)}
+            variant="outlined"
+            size="small"
+          />
+        )}
+      </Box>
+
+      <LinearProgress sx={{ mb: 2 }} />
+
+      <Typography variant="body2" sx={{ whiteSpace: 'pre-wrap', minHeight: 48 }}>
+        {report || 'Waiting for the model...'}
+      </Typography>
+
+      {findings.length > 0 && (
+        <Box sx={{ mt: 2 }}>
+          {findings.map((finding, index) => (
+            <Chip key={index} label={finding.finding} size="small" sx={{ mr: 1, mb: 1 }} />
+          ))}
+        </Box>
+      )}
+    </Paper>
+  );
+};
+
+export default StreamingReport;
@@ -21,7 +21,8 @@ class ApiService {
         
         if (error.response) {
           // Server responded with error status
-          const message = error.response.data?.detail || 
+          const detail = error.response.data?.detail;
+          const message = (typeof detail === 'string' ? detail : detail?.message) || 
                          error.response.data?.message || 
                          `Server error: ${error.response.status}`;
           throw new Error(message);
@@ -45,22 +46,26 @@ class ApiService {
     }
   }
 
-  async analyzeImage(file) {
-    try {
-      // Validate file
-      if (!file) {
-        throw new Error('No file provided');
-      }
+  validateFile(file) {
+    if (!file) {
+      throw new Error('No file provided');
+    }
 
-      const allowedTypes = ['image/jpeg', 'image/jpg', 'image/png', 'image/bmp', 'image/tiff'];
-      if (!allowedTypes.includes(file.type)) {
-        throw new Error('Unsupported file type. Please upload a JPG, PNG, BMP, or TIFF image.');
-      }
+    const allowedTypes = ['image/jpeg', 'image/jpg', 'image/png', 'image/bmp', 'image/tiff'];
+    if (!allowedTypes.includes(file.type)) {
+      throw new Error('Unsupported file type. Please upload a JPG, PNG, BMP, or TIFF image.');
+    }
 
-      const maxSize = 10 * 1024 * 1024; // 10MB
-      if (file.size > maxSize) {
-        throw new Error('File too large. Please upload an image smaller than 10MB.');
-      }
+    const maxSize = 10 * 1024 * 1024; // 10MB
+    if (file.size > maxSize) {
+      throw new Error('File too large. Please upload an image smaller than 10MB.');
+    }
+  }
+
+  // preset (optional): 'legacy', 'clahe', 'windowed' or 'lung_crop'; server default otherwise
+  async analyzeImage(file, preset) {
+    try {
+      this.validateFile(file);
 
       // Create form data
       const formData = new FormData();
@@ -68,6 +73,7 @@ class ApiService {
 
       // Make API call
       const response = await this.client.post('/analyze', formData, {
+        params: preset ? { preset } : undefined,
         headers: {
           'Content-Type': 'multipart/form-data',
         },
@@ -86,7 +92,62 @@ class ApiService {
     }
   }
 
-  async batchAnalyze(files) {
+  // Streams the report as it is generated. onEvent receives each event:
+  // {type: 'token'|'findings'|'result'|'error', ...}. Resolves with the final result.
+  async analyzeImageStream(file, onEvent, preset) {
+    this.validateFile(file);
+
+    const formData = new FormData();
+    formData.append('file', file);
+
+    const query = preset ? `?preset=${encodeURIComponent(preset)}` : '';
+    const response = await fetch(`${API_BASE_URL}/analyze/stream${query}`, {
+      method: 'POST',
+      body: formData,
+    });
+
+    if (!response.ok) {
+      const data = await response.json().catch(() => ({}));
+      const detail = data.detail;
+      throw new Error(
+        (typeof detail === 'string' ? detail : detail?.message) ||
+        `Server error: ${response.status}`
+      );
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let result = null;
+
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+
+      buffer += decoder.decode(value, { stream: true });
+      const lines = buffer.split('\n');
+      buffer = lines.pop();
+
+      for (const line of lines) {
+        if (!line.trim()) continue;
+        const event = JSON.parse(line);
+        if (onEvent) onEvent(event);
+        if (event.type === 'error') {
+          throw new Error(event.detail);
+        }
+        if (event.type === 'result') {
+          result = event;
+        }
+      }
+    }
+
+    if (!result) {
+      throw new Error('Stream ended before the analysis completed');
+    }
+    return result;
+  }
+
+  async batchAnalyze(files, preset) {
     try {
       if (!files || files.length === 0) {
         throw new Error('No files provided');
@@ -102,6 +163,7 @@ class ApiService {
       });
 
       const response = await this.client.post('/batch-analyze', formData, {
+        params: preset ? { preset } : undefined,
         headers: {
           'Content-Type': 'multipart/form-data',
         },